@@ -0,0 +1,100 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import os
+import sqlite3
+"""
+This module keeps a record of a finished copy: the inode, size, mtime, ctime
+and checksum of each regular file in the source, as they were when it was
+copied. The next -u or -i run uses the record as its baseline. A source file
+which still has the same inode, size, mtime and ctime has not changed since
+it was copied, so there is no need to stat the destination (or the previous
+backup) to find out whether to copy it, and its checksum is still good (a
+compare run uses it in place of checksumming the source again). The ctime
+catches changes to the mode and ownership (chmod and chown), which
+leave the mtime alone but matter to -p copies and to -i hard links.
+
+The record is a sqlite database, with paths relative to the source
+directory. It is written to a temporary file which is then renamed, so a
+copy which dies part way through leaves the last record in place.
+"""
+
+
+class Baseline:
+    """The record of an earlier copy, read from filename. Raises
+    sqlite3.DatabaseError if filename is not a baseline."""
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        meta = dict(self.db.execute("SELECT KEY, VALUE FROM META"))
+        self.source = meta["source"]
+        self.destination = meta["destination"]
+        self.checksum = meta["checksum"]
+        self.chunksize = int(meta["chunksize"])
+        # Baselines written before the ctime was recorded can't be trusted.
+        self.db.execute("SELECT CTIME FROM FILES LIMIT 1")
+
+    def lookup(self, path):
+        """(inode, size, mtime, ctime, checksum, chunks) of path when it was
+        copied, or None if it is not in the baseline."""
+        return(self.db.execute("""SELECT INODE, SIZE, MTIME, CTIME, CHECKSUM,
+        CHUNKS FROM FILES WHERE PATH = ?""", (path,)).fetchone())
+
+    def recorded(self, path, filestat):
+        """(checksum, chunks) recorded for path if filestat (an lstat of
+        path) matches the baseline, or None if it does not."""
+        row = self.lookup(path)
+        if (row is not None and row[0] == filestat.st_ino and
+            row[1] == filestat.st_size and row[2] == filestat.st_mtime and
+            row[3] == filestat.st_ctime):
+            return(row[4:])
+        return(None)
+
+    def unchanged(self, path, filestat):
+        """True if filestat (an lstat of path) matches the baseline."""
+        return(self.recorded(path, filestat) is not None)
+
+    def close(self):
+        self.db.close()
+
+
+class Writer:
+    """Write a new baseline to filename. checksum is the checksum algorithm,
+    and chunksize the chunk size the tree checksums of chunked files were
+    made with."""
+    def __init__(self, filename, source, destination, checksum, chunksize):
+        self.filename = filename
+        self.tmpfile = filename + ".tmp"
+        if os.path.exists(self.tmpfile):
+            os.unlink(self.tmpfile)
+        self.db = sqlite3.connect(self.tmpfile)
+        self.db.text_factory = str
+        self.db.execute("CREATE TABLE META(KEY TEXT PRIMARY KEY, VALUE TEXT)")
+        self.db.execute("""CREATE TABLE FILES(
+PATH TEXT PRIMARY KEY,
+INODE INTEGER,
+SIZE INTEGER,
+MTIME REAL,
+CTIME REAL,
+CHECKSUM TEXT,
+CHUNKS INTEGER)""")
+        self.db.executemany("INSERT INTO META VALUES (?,?)",
+                            (("source", source),
+                             ("destination", destination),
+                             ("checksum", checksum),
+                             ("chunksize", str(chunksize))))
+
+    def add(self, rows):
+        """Add (path, inode, size, mtime, ctime, checksum, chunks) rows.
+        checksum is None if the file was not checksummed; chunks is -1 if
+        checksum is of the whole file, or the number of chunks in its tree
+        checksum."""
+        self.db.executemany("""INSERT OR REPLACE INTO FILES
+        VALUES (?,?,?,?,?,?,?)""", rows)
+
+    def commit(self):
+        """Put the new baseline in place."""
+        self.db.commit()
+        self.db.close()
+        os.rename(self.tmpfile, self.filename)
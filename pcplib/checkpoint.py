@@ -0,0 +1,176 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import gzip
+import os
+import cPickle as pickle
+"""
+This module writes checkpoints of a sqlite database as an append-only
+journal.
+
+A checkpoint file is a series of gzip members. The first member is a
+snapshot of every table in the database; each following member holds the
+rows which have changed since the previous checkpoint. Each member is a
+stream of pickled records:
+
+("ROWS", table, columns, [rows])  insert or replace rows
+("DELETE", table, [ids])          delete rows by ID
+("END",)                          the member is complete
+
+Tables must have an integer primary key called ID. A member which was not
+completed (eg the program died while appending) is ignored on restore.
+"""
+
+MAGIC = ("PCPCHECKPOINT", 1)
+# rows per record
+BATCH = 10000
+
+
+def _records(filename):
+    """Generate the records in a checkpoint file, stopping quietly at a
+    truncated member."""
+    dumpfile = gzip.open(filename, "rb")
+    try:
+        if pickle.load(dumpfile) != MAGIC:
+            raise IOError("%s is not a checkpoint journal" % filename)
+        while True:
+            try:
+                record = pickle.load(dumpfile)
+            except (EOFError, IOError, pickle.UnpicklingError):
+                return
+            yield record
+    finally:
+        dumpfile.close()
+
+
+def isjournal(filename):
+    """Returns true if filename is a checkpoint journal, rather than an old
+    style SQL dump."""
+    dumpfile = gzip.open(filename, "rb")
+    try:
+        return(pickle.load(dumpfile) == MAGIC)
+    except Exception:
+        return(False)
+    finally:
+        dumpfile.close()
+
+
+def restore(db, filename):
+    """Load the checkpoint in filename into db. The tables must already
+    exist; columns are matched by name, so checkpoints written by older
+    versions of the schema can still be loaded."""
+    isolation = db.isolation_level
+    db.isolation_level = None
+    try:
+        db.execute("BEGIN")
+        for record in _records(filename):
+            if record[0] == "ROWS":
+                table, columns, rows = record[1:]
+                db.executemany("INSERT OR REPLACE INTO %s (%s) VALUES (%s)"
+                               % (table, ",".join(columns),
+                                  ",".join("?" * len(columns))), rows)
+            elif record[0] == "DELETE":
+                table, ids = record[1:]
+                db.executemany("DELETE FROM %s WHERE ID = ?" % table,
+                               ((i,) for i in ids))
+            elif record[0] == "END":
+                db.execute("COMMIT")
+                db.execute("BEGIN")
+        # Anything after the last END is from an incomplete checkpoint.
+        db.execute("ROLLBACK")
+    finally:
+        db.isolation_level = isolation
+
+
+class Checkpoint:
+    """Writes checkpoints of db to filename.
+
+    The first checkpoint is a full snapshot; after that only rows which have
+    been reported with changed() or deleted() are appended. Once the appended
+    data grows larger than the snapshot, the next checkpoint writes a fresh
+    snapshot instead (compaction).
+    """
+    def __init__(self, db, filename):
+        self.db = db
+        self.filename = filename
+        self.changes = {}
+        self.deletes = {}
+        self.snapshotsize = 0
+        self.appendsize = 0
+
+    def changed(self, table, idx):
+        """Record that row idx in table has been inserted or updated."""
+        if table not in self.changes:
+            self.changes[table] = set()
+        self.changes[table].add(idx)
+
+    def deleted(self, table, idx):
+        """Record that row idx in table has been deleted."""
+        if table not in self.deletes:
+            self.deletes[table] = set()
+        self.deletes[table].add(idx)
+        if table in self.changes:
+            self.changes[table].discard(idx)
+
+    def write(self, compact=False):
+        """Write a checkpoint. Returns True if a full snapshot was written,
+        False if only the changes were appended."""
+        if (compact or self.snapshotsize == 0 or
+            self.appendsize > self.snapshotsize or
+            not os.path.exists(self.filename)):
+            self._snapshot()
+            return(True)
+        self._append()
+        return(False)
+
+    def _tables(self):
+        return([r[0] for r in self.db.execute(
+            """SELECT name FROM sqlite_master WHERE type = 'table'
+            AND name NOT LIKE 'sqlite_%'""")])
+
+    def _snapshot(self):
+        tmpfile = self.filename + "__PARTIAL__"
+        dumpfile = gzip.open(tmpfile, "wb")
+        pickle.dump(MAGIC, dumpfile, 2)
+        for table in self._tables():
+            cursor = self.db.execute("SELECT * FROM %s" % table)
+            columns = [c[0] for c in cursor.description]
+            while True:
+                rows = cursor.fetchmany(BATCH)
+                if not rows:
+                    break
+                pickle.dump(("ROWS", table, columns, rows), dumpfile, 2)
+        pickle.dump(("END",), dumpfile, 2)
+        dumpfile.close()
+        os.rename(tmpfile, self.filename)
+        self.snapshotsize = os.path.getsize(self.filename)
+        self.appendsize = 0
+        self.changes = {}
+        self.deletes = {}
+
+    def _append(self):
+        startsize = os.path.getsize(self.filename)
+        rawfile = open(self.filename, "ab")
+        dumpfile = gzip.GzipFile(fileobj=rawfile, mode="wb")
+        for table, ids in self.changes.iteritems():
+            cursor = self.db.execute("SELECT * FROM %s LIMIT 0" % table)
+            columns = [c[0] for c in cursor.description]
+            ids = list(ids)
+            # sqlite limits the number of parameters in a query.
+            for i in xrange(0, len(ids), 500):
+                batch = ids[i:i+500]
+                rows = self.db.execute("SELECT * FROM %s WHERE ID IN (%s)"
+                                       % (table, ",".join("?" * len(batch))),
+                                       batch).fetchall()
+                pickle.dump(("ROWS", table, columns, rows), dumpfile, 2)
+        for table, ids in self.deletes.iteritems():
+            pickle.dump(("DELETE", table, list(ids)), dumpfile, 2)
+        pickle.dump(("END",), dumpfile, 2)
+        dumpfile.close()
+        rawfile.flush()
+        os.fsync(rawfile.fileno())
+        rawfile.close()
+        self.appendsize += os.path.getsize(self.filename) - startsize
+        self.changes = {}
+        self.deletes = {}
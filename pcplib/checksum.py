@@ -0,0 +1,225 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import ctypes
+import ctypes.util
+import hashlib
+import Queue
+import sys
+import threading
+import zlib
+"""
+This module provides the checksum algorithms pcp can use to verify copies,
+a hasher which does the checksumming on a separate thread so that it
+overlaps the reads and writes of the copy, and functions to make a checksum
+for a whole file out of the checksums of its chunks.
+
+md5, sha1, sha256, crc32 and adler32 are always available. blake2b, crc32c
+and xxh64 are available if the pyblake2, crc32c and xxhash modules are
+installed.
+"""
+
+try:
+    import pyblake2
+except ImportError:
+    pyblake2 = None
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+class _Checksum:
+    """hashlib style wrapper around a running checksum function such as
+    zlib.crc32."""
+    def __init__(self, function, initial):
+        self.function = function
+        self.value = initial
+
+    def update(self, data):
+        self.value = self.function(data, self.value)
+
+    def hexdigest(self):
+        return("%08x" % (self.value & 0xffffffff))
+
+
+def _crc32c(data, value):
+    return(crc32c.crc32(data, value))
+
+
+# name: (constructor, available)
+_ALGORITHMS = {
+    "md5": (lambda: hashlib.new("md5"), True),
+    "sha1": (lambda: hashlib.new("sha1"), True),
+    "sha256": (lambda: hashlib.new("sha256"), True),
+    "crc32": (lambda: _Checksum(zlib.crc32, 0), True),
+    "adler32": (lambda: _Checksum(zlib.adler32, 1), True),
+    "blake2b": (lambda: pyblake2.blake2b(), pyblake2 is not None),
+    "crc32c": (lambda: _Checksum(_crc32c, 0), crc32c is not None),
+    "xxh64": (lambda: xxhash.xxh64(), xxhash is not None),
+}
+
+
+# zlib can work out the crc32 / adler32 of two blocks of data joined together
+# from the checksums of the blocks, which gives us the checksum of a whole
+# file from the checksums of its chunks without reading it again.
+try:
+    _libz = ctypes.CDLL(ctypes.util.find_library("z") or "libz.so.1")
+    _COMBINE = {}
+    for _name in ("crc32", "adler32"):
+        try:
+            _fn = getattr(_libz, _name + "_combine64")
+            _fn.argtypes = [ctypes.c_ulong, ctypes.c_ulong, ctypes.c_int64]
+        except AttributeError:
+            _fn = getattr(_libz, _name + "_combine")
+            _fn.argtypes = [ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long]
+        _fn.restype = ctypes.c_ulong
+        _COMBINE[_name] = _fn
+except (OSError, AttributeError):
+    _COMBINE = {}
+
+
+def available():
+    """Returns a sorted list of the checksum algorithms which can be used
+    here."""
+    return(sorted(name for name, (new, ok) in _ALGORITHMS.iteritems() if ok))
+
+
+def new(algorithm):
+    """Returns a new hashlib style object (with update() and hexdigest()) for
+    algorithm. Raises ValueError if the algorithm is not available."""
+    if algorithm not in available():
+        raise ValueError("checksum algorithm %s is not available" % algorithm)
+    return(_ALGORITHMS[algorithm][0]())
+
+
+def combinable():
+    """Returns a sorted list of the algorithms for which combine() works."""
+    return(sorted(_COMBINE))
+
+
+def combine(algorithm, parts):
+    """Returns the checksum of a file from the checksums of its chunks. parts
+    is a list of (hexdigest, length) tuples for each chunk in order. Only
+    algorithms in combinable() are supported."""
+    if not parts:
+        return(new(algorithm).hexdigest())
+    fn = _COMBINE[algorithm]
+    value = int(parts[0][0], 16)
+    for digest, length in parts[1:]:
+        value = fn(value, int(digest, 16), length)
+    return("%08x" % (value & 0xffffffff))
+
+
+def treehash(algorithm, digests):
+    """Returns a checksum for a file from the checksums of its chunks, in
+    order. This is the checksum (with the same algorithm) of the chunk
+    hexdigests, each followed by a newline, so it depends on the chunk size
+    used."""
+    tophash = new(algorithm)
+    for digest in digests:
+        tophash.update(digest + "\n")
+    return(tophash.hexdigest())
+
+
+class Hasher:
+    """Checksums the data passed to update() on a separate thread.
+
+    Data is collected into batches of at least batchsize bytes, so the cost
+    of handing data to the thread is spread over many reads. The caller can
+    read the next batch while the previous one is being hashed; at most
+    depth batches are queued before update() blocks. The thread is only
+    started when the second batch is ready, so files which fit into a single
+    batch are hashed inline.
+
+    Only algorithms which release the GIL while hashing (those from hashlib)
+    actually run in parallel with the I/O.
+
+    If the data passed to update() lives in a reusable buffer, pass the
+    buffer as well; it is handed to release() once the data has been hashed.
+    """
+    def __init__(self, algorithm, batchsize=4*1024*1024, depth=2,
+                 release=None):
+        self.hash = new(algorithm)
+        self.batchsize = batchsize
+        self.release = release
+        self.depth = depth
+        self.batch = []
+        self.batchbytes = 0
+        self.pending = None
+        self.queue = None
+        self.thread = None
+        self.error = None
+
+    def update(self, data, buf=None):
+        self.batch.append((data, buf))
+        self.batchbytes += len(data)
+        if self.batchbytes >= self.batchsize:
+            self._flush()
+
+    def _flush(self):
+        batch = self.batch
+        self.batch = []
+        self.batchbytes = 0
+        if self.thread is not None:
+            self.queue.put(batch)
+        elif self.pending is None:
+            self.pending = batch
+        else:
+            self.queue = Queue.Queue(self.depth)
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+            self.queue.put(self.pending)
+            self.queue.put(batch)
+            self.pending = None
+
+    def _run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            if self.error is not None:
+                # Keep draining so update() does not block.
+                continue
+            try:
+                self._hash(batch)
+            except Exception:
+                self.error = sys.exc_info()
+
+    def _hash(self, batch):
+        for data, buf in batch:
+            self.hash.update(data)
+            if buf is not None and self.release is not None:
+                self.release(buf)
+
+    def hexdigest(self):
+        """Wait for the queued data to be hashed and return the checksum."""
+        if self.thread is not None:
+            if self.batch:
+                self._flush()
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            if self.error is not None:
+                raise self.error[0], self.error[1], self.error[2]
+        else:
+            for batch in (self.pending, self.batch):
+                self._hash(batch or [])
+            self.pending = None
+            self.batch = []
+            self.batchbytes = 0
+        return(self.hash.hexdigest())
+
+    def close(self):
+        """Stop the hashing thread without waiting for the checksum; used when
+        the copy fails part way through."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,125 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import ctypes
+import errno
+import fcntl
+import io
+import mmap
+import os
+"""
+This module provides a pool of reusable, page aligned I/O buffers and a file
+class which can read and write them with O_DIRECT, bypassing the page cache.
+
+Reading into a pooled buffer with readinto() saves allocating a new string
+for every block. Buffers are handed out as read-only buffer() objects, which
+hashlib, zlib and file writes accept without copying.
+"""
+
+# O_DIRECT needs the buffer, file offset and length aligned to the logical
+# block size of the device; the page size covers all the devices we care
+# about.
+ALIGN = mmap.PAGESIZE
+# Smallest buffer we hand out.
+MINSIZE = 1024 * 1024
+
+
+def bufsize(blksize):
+    """Returns the buffer size to use for a file with the given st_blksize:
+    at least MINSIZE, rounded up to a multiple of ALIGN."""
+    size = max(blksize, MINSIZE)
+    return(((size + ALIGN - 1) // ALIGN) * ALIGN)
+
+
+class Buffer:
+    """A page aligned buffer of size bytes."""
+    def __init__(self, size):
+        self.size = size
+        # Anonymous maps are always page aligned.
+        self.mmap = mmap.mmap(-1, size)
+        # mmap objects do not support memoryview in python 2, but ctypes
+        # arrays do; we need the memoryview to read into part of the buffer.
+        self.view = memoryview((ctypes.c_char * size).from_buffer(self.mmap))
+
+    def readinto(self, fileobj, length):
+        """Read up to length bytes from fileobj into the start of the buffer.
+        Returns the number of bytes read."""
+        return(fileobj.readinto(self.view[:length]))
+
+    def data(self, length):
+        """Returns the first length bytes of the buffer as a read-only
+        buffer object. It is only valid until the buffer is reused."""
+        return(buffer(self.mmap, 0, length))
+
+
+class BufferPool:
+    """A pool of Buffers of the same size. Buffers are allocated on demand
+    and kept for reuse once they are returned with put(). get() and put() are
+    safe to call from several threads."""
+    def __init__(self, size):
+        self.size = size
+        self.free = []
+
+    def get(self):
+        try:
+            return(self.free.pop())
+        except IndexError:
+            return(Buffer(self.size))
+
+    def put(self, buf):
+        self.free.append(buf)
+
+
+_pools = {}
+
+
+def getpool(size):
+    """Returns the shared pool of buffers of size bytes."""
+    pool = _pools.get(size)
+    if pool is None:
+        pool = _pools.setdefault(size, BufferPool(size))
+    return(pool)
+
+
+class File(io.FileIO):
+    """An unbuffered file which is opened with O_DIRECT if direct is set.
+
+    mode is "r" (read), "w" (create or truncate and write) or "r+" (write to
+    an existing file). If the filesystem does not support O_DIRECT the file
+    is opened normally; the direct attribute says which happened.
+
+    With O_DIRECT, reads and writes must be made with aligned buffers (see
+    Buffer) at aligned offsets. Reads should ask for a multiple of ALIGN
+    bytes; a write which is not a multiple of ALIGN bytes (the end of a
+    file) is done without O_DIRECT.
+    """
+    def __init__(self, filename, mode, direct=False):
+        flags = {"r": os.O_RDONLY,
+                 "w": os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 "r+": os.O_WRONLY}[mode]
+        self.direct = False
+        fd = None
+        if direct:
+            try:
+                fd = os.open(filename, flags | os.O_DIRECT, 0666)
+                self.direct = True
+            except OSError, error:
+                if error.errno != errno.EINVAL:
+                    raise
+        if fd is None:
+            fd = os.open(filename, flags, 0666)
+        io.FileIO.__init__(self, fd, "rb" if mode == "r" else "wb")
+
+    def write(self, data):
+        """Write all of data, which may be any buffer object."""
+        length = len(data)
+        if self.direct and length % ALIGN:
+            fd = self.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+            self.direct = False
+        written = io.FileIO.write(self, data)
+        while written < length:
+            written += io.FileIO.write(self, buffer(data, written))
+        return(length)
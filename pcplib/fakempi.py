@@ -0,0 +1,370 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import cPickle as pickle
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import deque
+"""
+This module is an in-process stand-in for the parts of mpi4py's MPI module
+which pcp uses, so that hundreds of ranks can be simulated in one process
+without a cluster (see tests/simpcp.py).
+
+Each rank of a World runs in its own thread; COMM_WORLD is the communicator
+of the rank of the calling thread. Messages are pickled on the way through,
+as mpi4py does, so senders and receivers never share objects. Sends are
+buffered, so send and isend never block.
+
+    world = fakempi.World(100)
+    world.run(main)            # calls main() in each of the 100 ranks
+
+install() puts the module in place of mpi4py, so that code which does
+"from mpi4py import MPI" gets it; it has to be called before that code is
+imported.
+"""
+
+ANY_SOURCE = -1
+ANY_TAG = -1
+UNDEFINED = -32766
+
+# A rank which finds no message waiting in Iprobe sleeps, so that ranks
+# which poll do not starve the others of the GIL. The sleep starts at
+# POLLSLEEP and doubles each time Iprobe finds nothing, up to World.maxsleep.
+POLLSLEEP = 1e-5
+
+_local = threading.local()
+
+
+class Aborted(SystemExit):
+    """Raised in every rank when one of them calls Abort."""
+    pass
+
+
+class Status:
+    def __init__(self):
+        self.source = ANY_SOURCE
+        self.tag = ANY_TAG
+
+    def Get_source(self):
+        return(self.source)
+
+    def Get_tag(self):
+        return(self.tag)
+
+    def Set_source(self, source):
+        self.source = source
+
+    def Set_tag(self, tag):
+        self.tag = tag
+
+
+class Request:
+    """Sends complete at once, so there is never anything to wait for."""
+    def wait(self, status=None):
+        return(None)
+
+    def test(self, status=None):
+        return((True, None))
+
+    @staticmethod
+    def waitall(requests, statuses=None):
+        return([None] * len(requests))
+
+
+class _Mailbox:
+    """Messages waiting to be received by one rank of a communicator."""
+    def __init__(self):
+        self.messages = deque()
+        self.cond = threading.Condition()
+
+    def find(self, source, tag):
+        for i, (msource, mtag, data) in enumerate(self.messages):
+            if ((source == ANY_SOURCE or source == msource) and
+                (tag == ANY_TAG or tag == mtag)):
+                return(i)
+        return(None)
+
+
+class _Context:
+    """The state shared by the ranks of a communicator: their mailboxes, the
+    rendezvous for collective operations and counts of the messages sent."""
+    def __init__(self, world, size):
+        self.world = world
+        self.size = size
+        self.mailboxes = [_Mailbox() for i in range(size)]
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.arrived = 0
+        self.values = [None] * size
+        self.result = None
+        # [messages, bytes] sent, by tag.
+        self.sent = {}
+        world.contexts.append(self)
+
+    def exchange(self, rank, value, combine=None):
+        """Collective rendezvous: waits until every rank has called, then
+        returns the list of the values they passed in (or what combine
+        makes of that list, which is worked out once for all ranks)."""
+        with self.cond:
+            generation = self.generation
+            self.values[rank] = value
+            self.arrived += 1
+            if self.arrived == self.size:
+                values = self.values
+                if combine is not None:
+                    values = combine(values)
+                self.result = values
+                self.values = [None] * self.size
+                self.arrived = 0
+                self.generation += 1
+                self.cond.notify_all()
+                return(values)
+            while self.generation == generation:
+                self.world.check()
+                self.cond.wait()
+            # Nobody can start the next collective until we have left this
+            # one, so result is still ours.
+            return(self.result)
+
+
+class Comm:
+    """A communicator, as seen from one of its ranks."""
+    def __init__(self, context, rank):
+        self.context = context
+        self.rank = rank
+        self.size = context.size
+        self.pollsleep = POLLSLEEP
+
+    def Get_rank(self):
+        return(self.rank)
+
+    def Get_size(self):
+        return(self.size)
+
+    @property
+    def sent(self):
+        """{tag: [messages, bytes]} sent on this communicator by all of its
+        ranks (not part of mpi4py)."""
+        return(self.context.sent)
+
+    def send(self, obj, dest, tag=0):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        mailbox = self.context.mailboxes[dest]
+        with mailbox.cond:
+            mailbox.messages.append((self.rank, tag, data))
+            counts = self.context.sent.setdefault(tag, [0, 0])
+            counts[0] += 1
+            counts[1] += len(data)
+            mailbox.cond.notify_all()
+
+    def isend(self, obj, dest, tag=0):
+        self.send(obj, dest, tag)
+        return(Request())
+
+    def recv(self, buf=None, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        mailbox = self.context.mailboxes[self.rank]
+        with mailbox.cond:
+            while True:
+                i = mailbox.find(source, tag)
+                if i is not None:
+                    break
+                self.context.world.check()
+                mailbox.cond.wait()
+            msource, mtag, data = mailbox.messages[i]
+            del mailbox.messages[i]
+        if status is not None:
+            status.Set_source(msource)
+            status.Set_tag(mtag)
+        return(pickle.loads(data))
+
+    def Iprobe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        mailbox = self.context.mailboxes[self.rank]
+        with mailbox.cond:
+            i = mailbox.find(source, tag)
+            if i is not None:
+                if status is not None:
+                    msource, mtag, data = mailbox.messages[i]
+                    status.Set_source(msource)
+                    status.Set_tag(mtag)
+                self.pollsleep = POLLSLEEP
+                return(True)
+        world = self.context.world
+        world.check()
+        time.sleep(self.pollsleep)
+        self.pollsleep = min(self.pollsleep * 2, world.maxsleep)
+        return(False)
+
+    def Probe(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        mailbox = self.context.mailboxes[self.rank]
+        with mailbox.cond:
+            while True:
+                i = mailbox.find(source, tag)
+                if i is not None:
+                    break
+                self.context.world.check()
+                mailbox.cond.wait()
+            if status is not None:
+                msource, mtag, data = mailbox.messages[i]
+                status.Set_source(msource)
+                status.Set_tag(mtag)
+        return(True)
+
+    def gather(self, sendobj, root=0):
+        values = self.context.exchange(self.rank, sendobj)
+        if self.rank == root:
+            return(list(values))
+        return(None)
+
+    def allgather(self, sendobj):
+        return(list(self.context.exchange(self.rank, sendobj)))
+
+    def bcast(self, obj, root=0):
+        data = self.context.exchange(self.rank, obj)[root]
+        if self.rank == root:
+            return(obj)
+        # Everyone else gets a copy, as they would from mpi4py.
+        return(pickle.loads(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+
+    def barrier(self):
+        self.context.exchange(self.rank, None)
+
+    Barrier = barrier
+
+    def Dup(self):
+        world = self.context.world
+        context = self.context.exchange(
+            self.rank, None, lambda values: _Context(world, self.size))
+        return(Comm(context, self.rank))
+
+    def Split(self, color=0, key=0):
+        world = self.context.world
+
+        def split(values):
+            groups = {}
+            for rank, (c, k) in enumerate(values):
+                if c != UNDEFINED:
+                    groups.setdefault(c, []).append((k, rank))
+            return(dict((c, (_Context(world, len(members)), sorted(members)))
+                        for c, members in groups.iteritems()))
+        groups = self.context.exchange(self.rank, (color, key), split)
+        if color == UNDEFINED:
+            return(COMM_NULL)
+        context, members = groups[color]
+        return(Comm(context, members.index((key, self.rank))))
+
+    def Free(self):
+        pass
+
+    def Abort(self, errorcode=0):
+        self.context.world.abort(errorcode)
+
+
+class _NullComm:
+    def __nonzero__(self):
+        return(False)
+
+COMM_NULL = _NullComm()
+
+
+class _CommWorld:
+    """COMM_WORLD stands for the world communicator of whichever rank uses
+    it."""
+    def __getattr__(self, name):
+        comm = getattr(_local, "comm", None)
+        if comm is None:
+            if name == "Abort":
+                # From a thread a rank started itself; there is only ever
+                # one world running.
+                return(World.running.abort)
+            raise RuntimeError("fakempi.COMM_WORLD used outside a rank")
+        return(getattr(comm, name))
+
+COMM_WORLD = _CommWorld()
+
+
+def Get_processor_name():
+    comm = _local.comm
+    return("node%i" % (comm.rank // comm.context.world.pernode))
+
+
+def get_vendor():
+    return(("fakempi", (1, 0, 0)))
+
+
+class World:
+    """A set of size ranks, pernode to a (pretend) node, each of which runs
+    in its own thread. Ranks polling for messages with Iprobe back off to
+    sleeping for maxsleep seconds between polls; by default this grows with
+    the number of ranks, to keep down the time spent polling."""
+    running = None
+
+    def __init__(self, size, pernode=None, maxsleep=None):
+        if maxsleep is None:
+            maxsleep = max(0.001, size * 1e-5)
+        self.maxsleep = maxsleep
+        self.contexts = []
+        self.aborted = None
+        self.pernode = pernode or size
+        self.context = _Context(self, size)
+        self.size = size
+
+    def check(self):
+        """Raise Aborted if a rank has aborted."""
+        if self.aborted is not None:
+            raise Aborted(self.aborted)
+
+    def abort(self, errorcode=1):
+        self.aborted = errorcode
+        for context in self.contexts:
+            with context.cond:
+                context.cond.notify_all()
+            for mailbox in context.mailboxes:
+                with mailbox.cond:
+                    mailbox.cond.notify_all()
+        raise Aborted(errorcode)
+
+    def run(self, target, *args):
+        """Call target(*args) in every rank, and wait for them all to
+        finish. Returns the list of what each rank returned, or its exit
+        code if it raised SystemExit. An exception in any rank aborts the
+        world."""
+        results = [None] * self.size
+
+        def rank(r):
+            _local.comm = Comm(self.context, r)
+            try:
+                results[r] = target(*args)
+            except SystemExit, e:
+                results[r] = e.code
+            except Exception:
+                sys.stdout.write("Exception on rank %i:\n%s"
+                                 % (r, traceback.format_exc()))
+                try:
+                    self.abort(1)
+                except Aborted:
+                    results[r] = 1
+        World.running = self
+        threads = [threading.Thread(target=rank, args=(r,),
+                                    name="rank%i" % r)
+                   for r in range(self.size)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            # join() with no timeout cannot be interrupted by ^C.
+            while t.is_alive():
+                t.join(1)
+        World.running = None
+        return(results)
+
+
+def install():
+    """Make "from mpi4py import MPI" give this module."""
+    package = types.ModuleType("mpi4py")
+    package.MPI = sys.modules[__name__]
+    sys.modules["mpi4py"] = package
+    sys.modules["mpi4py.MPI"] = package.MPI
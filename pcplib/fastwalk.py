@@ -15,29 +15,25 @@ def fastwalk (sourcedir, onerror=None, topdown=True):
     filelist = []
 
     try:
-        entries = readdir.readdir(sourcedir)
+        entries = list(readdir.scandir(sourcedir))
     except Exception as  err:
         if onerror is not None:
             onerror(err)
         return
 
-    for entry in entries:
-        name = entry.d_name
-        filetype = entry.d_type
-    
-        if not name in (".", ".."):
-            if filetype == readdir.dirent.DT_UNKNOWN:
-                fullname = os.path.join(sourcedir, name)
-                mode = safestat.safestat(fullname).st_mode
-                if stat.S_ISDIR(mode):
-                    filetype = readdir.dirent.DT_DIR
-                else:
-                    filetype = readdir.dirent.DT_REG
-
-            if filetype == readdir.dirent.DT_DIR:
-                dirlist.append(name)
+    for name, filetype, ino in entries:
+        if filetype == readdir.dirent.DT_UNKNOWN:
+            fullname = os.path.join(sourcedir, name)
+            mode = safestat.safestat(fullname).st_mode
+            if stat.S_ISDIR(mode):
+                filetype = readdir.dirent.DT_DIR
             else:
-                filelist.append(name)
+                filetype = readdir.dirent.DT_REG
+
+        if filetype == readdir.dirent.DT_DIR:
+            dirlist.append(name)
+        else:
+            filelist.append(name)
 
     if topdown:
         yield sourcedir, dirlist, filelist
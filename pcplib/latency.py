@@ -0,0 +1,107 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import threading
+import time
+"""
+This module keeps latency histograms of the operations pcp spends its time
+on (stat, readdir, open, read, write and so on), for profiling slow copies.
+
+Callers time an operation themselves and hand the start time to
+Profiler.record:
+
+    if PROFILER:
+        start = latency.clock()
+    ...
+    if PROFILER:
+        PROFILER.record("stat", start)
+
+so that when profiling is off, the cost is a test of a global.
+"""
+
+clock = time.time
+
+
+class Histogram:
+    """Counts of latencies in power of two buckets. Bucket 0 holds latencies
+    under 1us, and bucket b those from 2**(b-1) up to 2**b us."""
+    BUCKETS = 40
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add the counts from another Histogram to this one."""
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        if self.count == 0:
+            return(0.0)
+        return(self.total / self.count)
+
+    def percentile(self, percent):
+        """An upper bound on the given percentile of the latencies, in
+        seconds (the top of the bucket it falls in)."""
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= wanted:
+                return(min((1 << bucket) / 1e6, self.max))
+        return(self.max)
+
+
+class Profiler:
+    """A set of named Histograms. record() is safe to call from several
+    threads."""
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, start):
+        """Record an operation which started at start (from clock()) and has
+        just finished. Returns the time now, so that back to back
+        operations can be timed without reading the clock twice."""
+        now = clock()
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(now - start)
+        return(now)
+
+
+def merge(histogramsets):
+    """Merge a list of {name: Histogram} dicts into one."""
+    merged = {}
+    for histograms in histogramsets:
+        for name, histogram in histograms.iteritems():
+            if name not in merged:
+                merged[name] = Histogram()
+            merged[name].merge(histogram)
+    return(merged)
+
+
+def pretty(seconds):
+    """Format a latency for printing."""
+    if seconds < 1e-3:
+        return("%.0fus" % (seconds * 1e6))
+    if seconds < 1:
+        return("%.1fms" % (seconds * 1e3))
+    return("%.2fs" % seconds)
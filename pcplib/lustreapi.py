@@ -18,9 +18,11 @@ gcc -shared -o liblustreapi.so *.o
 """
 import ctypes
 import ctypes.util
+import errno
+import fcntl
 import os
-import select
 import sys
+import threading
 
 
 import pkg_resources
@@ -39,6 +41,13 @@ if not liblocation:
 
 lustre = ctypes.CDLL(liblocation, use_errno=True)
 
+# Held while stderr is being captured.
+_stderrlock = threading.Lock()
+# The stderr capture for this process, made on first use.
+_capture = None
+# Per thread lov_user_md_v1 buffers for getstripe.
+_lovbuffers = threading.local()
+
 # ctype boilerplate for C data structures and functions
 class lov_user_ost_data_v1(ctypes.Structure):
     _fields_ = [
@@ -71,12 +80,13 @@ class stripeObj:
     This object contains details of the striping of a lustre file.
 
     Attributes:
-      lovdata:  lov_user_md_v1 structure as returned by the lustre C API.
+      lovdata:  lov_user_md_v1 structure as returned by the lustre C API, or
+      None. getstripe reuses its buffer, so it does not set this.
       stripecount: Stripe count.
       stripesize:  Stripe size (bytes).
       stripeoffset: Stripe offset.
       ostobjects[]: List of lov_user_ost_data_v1 structures as returned by the
-      C API.
+      C API (copies which stay valid after the next getstripe).
     """
     def __str__(self):
         string = "Stripe Count: %i Stripe Size: %i Stripe Offset: %i\n" \
@@ -87,7 +97,7 @@ class stripeObj:
         return(string)
         
     def __init__(self):
-        self.lovdata = lov_user_md_v1()
+        self.lovdata = None
         self.stripecount = -1
         self.stripesize = 0
         self.stripeoffset = -1
@@ -113,8 +123,11 @@ def getstripe(filename):
     
     """
     stripeobj = stripeObj()
-    lovdata = lov_user_md_v1()
-    stripeobj.lovdata = lovdata
+    # lov_user_md_v1 has room for 2000 OST objects, so rather than allocate
+    # (and zero) one for every file, each thread reuses its own.
+    lovdata = getattr(_lovbuffers, "lovdata", None)
+    if lovdata is None:
+        lovdata = _lovbuffers.lovdata = lov_user_md_v1()
     err = lustre.llapi_file_get_stripe(filename, ctypes.byref(lovdata))
 
     # err 61 is due to  LU-541 (see below)
@@ -131,7 +144,8 @@ def getstripe(filename):
 
     else:
         for i in range(0, lovdata.lmm_stripe_count):
-            stripeobj.ostobjects.append(lovdata.lmm_objects[i])
+            stripeobj.ostobjects.append(lov_user_ost_data_v1.from_buffer_copy(
+                lovdata.lmm_objects[i]))
 
         stripeobj.stripecount = lovdata.lmm_stripe_count
         stripeobj.stripesize = lovdata.lmm_stripe_size
@@ -184,12 +198,20 @@ def setstripe(filename, stripeobj=None, stripesize=0, stripeoffset=-1,
     # Capture the lustre error messages, These get printed to stderr via 
     # liblusteapi, and so we need to intercept them.
 
-    message = captureStderr()
-
-    fd = lustre.llapi_file_open(filename, flags, mode, stripesize,
-                                stripeoffset, stripecount, stripe_pattern)
-    message.readData()
-    message.stopCapture()
+    # stderr is shared by every thread in the process, so only one thread
+    # at a time can capture it.
+    global _capture
+    with _stderrlock:
+        if _capture is None:
+            _capture = captureStderr()
+        _capture.startCapture()
+        try:
+            fd = lustre.llapi_file_open(filename, flags, mode, stripesize,
+                                        stripeoffset, stripecount,
+                                        stripe_pattern)
+        finally:
+            _capture.stopCapture()
+            _capture.readData()
 
     if fd < 0:
         err = 0 - fd
@@ -200,28 +222,86 @@ def setstripe(filename, stripeobj=None, stripesize=0, stripeoffset=-1,
 
 
 class captureStderr():
-    """This class intercepts stderr and stores any output"""
+    """This class intercepts stderr and stores any output.
+
+    The pipe and the saved copy of the original stderr are kept open for the
+    life of the object, so capturing output from a call only costs a pair of
+    dup2s. Output is only captured between startCapture() and stopCapture().
+    """
     def __init__(self):
         self.pipeout, self.pipein = os.pipe()
+        flags = fcntl.fcntl(self.pipeout, fcntl.F_GETFL)
+        fcntl.fcntl(self.pipeout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
         self.oldstderr = os.dup(2)
-        os.dup2(self.pipein, 2)
         self.contents=""
 
     def __str__(self):
         return (self.contents)
 
+    def startCapture(self):
+        """Send stderr to the pipe, and forget any earlier output."""
+        self.contents = ""
+        os.dup2(self.pipein, 2)
+
     def readData(self):
         """Read data from stderr until there is no more."""
-        while self.checkData():
-            self.contents += os.read(self.pipeout, 1024)
-            
-    def checkData(self):
-        """Check to see if there is any data to be read."""
-        r, _, _ = select.select([self.pipeout], [], [], 0)
-        return bool(r)
+        while True:
+            try:
+                data = os.read(self.pipeout, 65536)
+            except OSError, error:
+                if error.errno == errno.EAGAIN:
+                    return
+                raise
+            if not data:
+                return
+            self.contents += data
 
     def stopCapture(self):
         """Restore the original stderr"""
         os.dup2(self.oldstderr, 2)
+
+    def close(self):
+        """Stop capturing and close the pipe."""
+        self.stopCapture()
+        os.close(self.oldstderr)
         os.close(self.pipeout)
         os.close(self.pipein)
+
+
+class layoutCache:
+    """Caches file striping by directory, for trees where the files in a
+    directory all have the striping they inherited when they were created.
+
+    The striping of the first file looked up in each directory is returned
+    for the rest of the files in it, which saves a getstripe per file. This
+    is wrong for files which have been given their own striping (with lfs
+    setstripe, for example), so the caller has to decide whether it is a
+    safe assumption.
+
+    At most size directories are remembered; the cache is emptied when it
+    fills up. Tree walks process the files of a directory together, so this
+    keeps the hit rate high without holding every directory of a big tree.
+    """
+    def __init__(self, size=10000):
+        self.size = size
+        self.layouts = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getstripe(self, filename):
+        """Returns a stripeObj with the striping of filename, which may have
+        come from another file in the same directory."""
+        dirname = os.path.dirname(filename)
+        with self.lock:
+            layout = self.layouts.get(dirname)
+            if layout is not None:
+                self.hits += 1
+                return(layout)
+            self.misses += 1
+        layout = getstripe(filename)
+        with self.lock:
+            if len(self.layouts) >= self.size:
+                self.layouts.clear()
+            self.layouts[dirname] = layout
+        return(layout)
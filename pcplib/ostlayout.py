@@ -0,0 +1,55 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import zlib
+"""
+This module tells pcp which lustre OSTs hold a file, for OST aware dispatch.
+
+A layout provider has a layout(filename) method which returns a tuple of
+(stripe size, [OST index of each stripe]). The list is empty if the layout
+is not known. LustreLayout asks lustre; FakeLayout makes up a layout from the
+file name, so that OST aware dispatch can be tested without lustre.
+"""
+
+
+class LustreLayout:
+    """Layouts of files on lustre, from lustreapi.getstripe."""
+    def __init__(self):
+        # Imported here so that FakeLayout works without liblustreapi.
+        from pcplib import lustreapi
+        self.lustreapi = lustreapi
+
+    def layout(self, filename):
+        try:
+            stripe = self.lustreapi.getstripe(filename)
+        except (IOError, OSError):
+            return((0, []))
+        return((stripe.stripesize, [o.l_ost_idx for o in stripe.ostobjects]))
+
+
+class FakeLayout:
+    """Pretend every file is striped over stripecount of count OSTs, starting
+    at an OST picked from a hash of the file name."""
+    def __init__(self, count, stripecount=1, stripesize=1024*1024):
+        self.count = count
+        self.stripecount = min(stripecount, count)
+        self.stripesize = stripesize
+
+    def layout(self, filename):
+        first = (zlib.crc32(filename) & 0xffffffff) % self.count
+        return((self.stripesize, [(first + i) % self.count
+                                  for i in range(self.stripecount)]))
+
+
+def rangeosts(layout, offset, length):
+    """Returns the sorted list of OSTs holding the length bytes of a file at
+    offset, given the layout of the file."""
+    stripesize, osts = layout
+    if not osts:
+        return([])
+    if stripesize <= 0 or length >= stripesize * len(osts):
+        return(sorted(set(osts)))
+    first = offset // stripesize
+    last = (offset + max(length, 1) - 1) // stripesize
+    return(sorted(set(osts[i % len(osts)] for i in xrange(first, last + 1))))
@@ -2,15 +2,47 @@
 # Author gmpc@sanger.ac.uk
 # This program is released under the GNU Public License V2 or later (GPLV2+)
 from mpi4py import MPI
+import itertools
 import os
 import random
 import stat
+import latency
 import readdir
 import time
 import safestat
 from collections import deque
+
+
+def _pathbytes(items):
+    """Total length of the paths in a list of (path, d_type) items."""
+    return(sum(len(item[0]) for item in items))
+
+
 class ParallelWalk():
-        def __init__(self, comm, results=None):
+    """Walk a directory tree in parallel.
+
+    Each walker holds its unprocessed nodes in two deques, one for
+    directories (which have yet to be enumerated) and one for everything
+    else. A walker works on its newest nodes, and idle walkers steal the
+    oldest nodes from their peers, preferring directories as they carry the
+    most future work.
+
+    steal sets the policy for choosing which peer to steal from: "random"
+    picks any peer at random; "local" tries peers on the same node first.
+    Counts of steals and of the data exchanged are kept in the stats
+    attribute. The data is counted as the total length of the paths, rather
+    than the size of the messages, which would mean pickling them twice.
+
+    If profiler (a latency.Profiler) is given, the time spent reading
+    directories and stat'ing files is recorded in it.
+
+    The walker reads directories with the scandir attribute and stats files
+    with lstat; a simulation can replace them (see simfs).
+    """
+    scandir = staticmethod(readdir.scandir)
+    lstat = staticmethod(safestat.safestat)
+
+    def __init__(self, comm, results=None, steal="random", profiler=None):
         self.comm = comm.Dup()
         self.rank = self.comm.Get_rank()
         self.workers = self.comm.size
@@ -20,9 +52,24 @@ class ParallelWalk():
         self.token = False
         self.first = True
         self.workrequest = False
-        self.items = deque()
+        self.diritems = deque()
+        self.fileitems = deque()
         self.results = results
         self.finished = False
+        self.localpeers = []
+        if steal == "local":
+            nodes = self.comm.allgather(MPI.Get_processor_name())
+            self.localpeers = [r for r in self.others
+                               if nodes[r] == nodes[self.rank]]
+        # Number of steal attempts which have failed since the last success.
+        self.failedsteals = 0
+        self.stats = {"requests": 0, "steals": 0, "itemsin": 0, "bytesin": 0,
+                      "given": 0, "itemsout": 0, "bytesout": 0}
+        # The d_type of the file being processed, and its lstat if we had to
+        # stat it to find out what it was (see ProcessFile).
+        self.filetype = readdir.dirent.DT_UNKNOWN
+        self.filestat = None
+        self.profiler = profiler
     
     def ProcessDir(self, directoryname):
         """This method is a stub called for each directory the walker 
@@ -39,12 +86,27 @@ class ParallelWalk():
         """This method is a stub called for each directory the walker 
         encounters.  Extend it for your own needs.
 
-        filename contains the name of the file being processed.
+        filename contains the name of the file being processed. The filetype
+        attribute holds its d_type (readdir.dirent.DT_REG etc). If the
+        filesystem did not give us a d_type, we stat the file; the filestat
+        attribute then holds the lstat result, otherwise it is None.
 
         If you have data which you want to return to the rank 0 process, use the results
         attribute; this is MPI gathered when the walkers are done."""
         pass
 
+    def Idle(self):
+        """This method is a stub called when the walker has run out of items
+        to process, just before it asks its peers for more work. Extend it if
+        you need to flush out any data you have been accumulating."""
+        pass
+
+    def Progress(self):
+        """This method is a stub called once on every pass through the
+        walker's main loop. Extend it if you need to do work, such as
+        handling messages from other code, while the walk is running."""
+        pass
+
     def _CheckforRequests(self):
         """Listen for incoming communication data from our peers and answer
         accordigly.
@@ -62,15 +124,12 @@ class ParallelWalk():
             tag = status.tag
 
             if tag == 0:
-                numitems = len(self.items)
-                if numitems > 1:
-                    split = random.randrange(1, numitems)
-    #            or split list in half
-    #                split = numitems / 2
-                    senditems = list(self.items)[:split]
-                    remainingitems = list(self.items)[split:]
-                    self.items = deque(remainingitems)
+                senditems = self._StealItems()
+                if senditems:
                     self.comm.send(senditems, dest=source, tag=1)
+                    self.stats["given"] += 1
+                    self.stats["itemsout"] += len(senditems)
+                    self.stats["bytesout"] += _pathbytes(senditems)
                     if source < self.rank:
                         self.colour = "Black"
                 else:
@@ -79,7 +138,14 @@ class ParallelWalk():
             if tag == 1:
                 self.mpirequest.wait()
                 if request != "NoWork":
-                    self.items.extendleft(request)
+                    for item in request:
+                        self._QueueNode(item)
+                    self.stats["steals"] += 1
+                    self.stats["itemsin"] += len(request)
+                    self.stats["bytesin"] += _pathbytes(request)
+                    self.failedsteals = 0
+                else:
+                    self.failedsteals += 1
                 self.workrequest = False
 
             if tag == 2:
@@ -89,33 +155,87 @@ class ParallelWalk():
                 self.finished = True
         return()
 
+    def _Pending(self):
+        """Number of nodes waiting to be processed."""
+        return(len(self.diritems) + len(self.fileitems))
+
+    def _QueueNode(self, item):
+        """Queue a (name, d_type) node to be processed."""
+        if (item[1] == readdir.dirent.DT_DIR or
+            item[1] == readdir.dirent.DT_UNKNOWN):
+            self.diritems.append(item)
+        else:
+            self.fileitems.append(item)
+
+    def _StealItems(self):
+        """Remove and return the nodes to give to a peer which has asked for
+        work: half of our directories or, if we have none, half of our
+        files. We keep the last node for ourselves. Costs O(nodes given)."""
+        ndirs = len(self.diritems)
+        nfiles = len(self.fileitems)
+        if ndirs + nfiles < 2:
+            return(None)
+        if ndirs > 0:
+            items = self.diritems
+            count = max(1, ndirs / 2)
+        else:
+            items = self.fileitems
+            count = nfiles / 2
+        # The oldest nodes are at the left. Old directories are nearer the
+        # top of the tree, so will have more under them.
+        popleft = items.popleft
+        return([popleft() for i in xrange(count)])
+
     def _ProcessNode(self):
         """Process a node in the directory tree. If the node is another directory, 
         enumerate its contents and add it to the list of nodes to be processed in the 
-        future."""
-        filename, filetype = self.items.pop()
+        future. Files are processed before directories, which leaves the
+        directories for our peers to steal."""
+        if self.fileitems:
+            filename, filetype = self.fileitems.pop()
+        else:
+            filename, filetype = self.diritems.pop()
 
         try:
             # If the filesystem supports readdir d_type, then we will know if the node is
             # a file or a directory without doing any extra work. If it does not, we have
             # to do a stat.
+            filestat = None
+            profiler = self.profiler
             if filetype == 0:
-                s = safestat.safestat(filename)
-                if stat.S_ISDIR(s.st_mode):
+                if profiler:
+                    start = latency.clock()
+                filestat = self.lstat(filename)
+                if profiler:
+                    profiler.record("stat", start)
+                if stat.S_ISDIR(filestat.st_mode):
                     filetype = readdir.dirent.DT_DIR
-                else:
+                elif stat.S_ISREG(filestat.st_mode):
                     filetype = readdir.dirent.DT_REG
+                elif stat.S_ISLNK(filestat.st_mode):
+                    filetype = readdir.dirent.DT_LNK
 
             # If we a directory, enumerate its contents and add them to the list of nodes
             # to be processed.
             if filetype == readdir.dirent.DT_DIR:
-                for node in readdir.readdir(filename):
-                    if not node.d_name in (".",".."):
-                        fullname = os.path.join(filename, node.d_name)
-                        self.items.appendleft((fullname, node.d_type))
+                if profiler:
+                    start = latency.clock()
+                dirappend = self.diritems.append
+                fileappend = self.fileitems.append
+                for name, d_type, ino in self.scandir(filename):
+                    fullname = os.path.join(filename, name)
+                    if (d_type == readdir.dirent.DT_DIR or
+                        d_type == readdir.dirent.DT_UNKNOWN):
+                        dirappend((fullname, d_type))
+                    else:
+                        fileappend((fullname, d_type))
+                if profiler:
+                    profiler.record("readdir", start)
             # Call the processing functions on the directory or file.
                 self.ProcessDir(filename)
             else:
+                self.filetype = filetype
+                self.filestat = filestat
                 self.ProcessFile(filename)
         except OSError as error:
             print "cannot access `%s':" % filename,
@@ -123,8 +243,14 @@ class ParallelWalk():
         return()
 
     def _AskForWork(self):
-        """Send a work request to a random peer."""
-        target = random.choice(self.others)
+        """Send a work request to a random peer. With the local steal policy,
+        peers on our node are tried first; we look further afield once we
+        have had as many failures in a row as we have local peers."""
+        if self.failedsteals < len(self.localpeers):
+            target = random.choice(self.localpeers)
+        else:
+            target = random.choice(self.others)
+        self.stats["requests"] += 1
         self.mpirequest = self.comm.isend("Hungry", dest=target, tag=0)
         self.workrequest = True
 
@@ -178,16 +304,28 @@ class ParallelWalk():
         self.comm.Free()
 
     def Execute(self, seed):
-        """This method starts the walkers. The rank 0 MPI walker takes a seed parameter,
-        which is the name of the first directory to walk.
+        """This method starts the walkers. seed is either the name of the first
+        directory to walk, which is given to the rank 0 walker, or an iterable
+        of names (eg a list or an open file), which is spread across all of
+        the walkers so they can start work straight away. Each walker takes
+        every nth name, so all ranks should pass the same sequence. Seeds
+        given this way need not be directories; files are passed to
+        ProcessFile.
 
         The rank 0 walker will return a list containing the results attributes for all of
         the walkers. This can be used to print out summary statistics etc.
         """
-        # Initialize the rank0 walker with the seed directory.
-        # TODO: Be able to take multiple seeds
+        if isinstance(seed, basestring):
+            # Initialize the rank0 walker with the seed directory.
+            if self.rank == 0:
+                self.diritems.append((seed, readdir.dirent.DT_DIR))
+        else:
+            # We don't know what type the seeds are, so _ProcessNode will
+            # stat them.
+            for name in itertools.islice(seed, self.rank, None,
+                                         self.workers):
+                self.diritems.append((name, readdir.dirent.DT_UNKNOWN))
         if self.rank == 0:
-            self.items.append((seed, 4))
             self.token = "White"
         else:
             self.token = False
@@ -198,15 +336,17 @@ class ParallelWalk():
 
         while self.finished == False:
             self._CheckforRequests ()
-            if len(self.items) > 0:
+            self.Progress()
+            if self._Pending() > 0:
                 self._ProcessNode()
             else:
                 # We only want one request in-flight, otherwise we
                 # ping-pong worklist between nodes.
                 if self.workrequest == False:
+                    self.Idle()
                     self._AskForWork()
             # If we have no more work, we might be 
-            if len(self.items) == 0:
+            if self._Pending() == 0:
                 self._CheckForTermination()
         # Gather the summary data from other ranks and then exit.
         data = self.gatherResults()
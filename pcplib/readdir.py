@@ -3,10 +3,16 @@
 # This program is released under the GNU Public License V2 or later (GPLV2+)
 
 import ctypes
+import errno
 import os
+import struct
 """
 This module provides a python interface to the readdir
 system call.
+
+scandir() reads many entries per system call with getdents64 and yields
+lightweight (name, d_type, ino) tuples; it should be used in preference to
+readdir() on large directories.
 """
 
 # Ctypes boilerplate for readdir/opendir/closedir
@@ -73,3 +79,58 @@ def readdir(directory):
             entries.append(d)
     _closedir(dirp)
     return (entries)
+
+
+# getdents64 syscall numbers. libc does not export a wrapper on older systems.
+_SYS_getdents64 = {"x86_64": 217, "aarch64": 61, "ppc64le": 202,
+                   "ppc64": 202}.get(os.uname()[4])
+_syscall = _clib.syscall
+_syscall.restype = ctypes.c_long
+# struct linux_dirent64 { u64 d_ino; s64 d_off; u16 d_reclen; u8 d_type;
+#                         char d_name[]; }
+_dirent64 = struct.Struct("=QqHB")
+# Size of the buffer we ask the kernel to fill on each call.
+BUFSIZE = 256 * 1024
+
+
+def _readdir_tuples(directory):
+    for d in readdir(directory):
+        if d.d_name not in (".", ".."):
+            yield (d.d_name, d.d_type, d.ino_t)
+
+
+def scandir(directory):
+    """Generate a (name, d_type, ino) tuple for each entry in directory,
+    excluding "." and "..". Entries are read from the kernel BUFSIZE bytes at
+    a time with getdents64. Falls back to readdir if getdents64 is not
+    available.
+    """
+    if _SYS_getdents64 is None:
+        for entry in _readdir_tuples(directory):
+            yield entry
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        buf = ctypes.create_string_buffer(BUFSIZE)
+        unpack = _dirent64.unpack_from
+        header = _dirent64.size
+        while True:
+            n = _syscall(ctypes.c_long(_SYS_getdents64), ctypes.c_long(fd),
+                         buf, ctypes.c_long(BUFSIZE))
+            if n < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                raise OSError(err, os.strerror(err))
+            if n == 0:
+                break
+            data = buf.raw[:n]
+            pos = 0
+            while pos < n:
+                ino, off, reclen, d_type = unpack(data, pos)
+                name = data[pos + header:data.index("\0", pos + header)]
+                pos += reclen
+                if name != "." and name != "..":
+                    yield (name, d_type, ino)
+    finally:
+        os.close(fd)
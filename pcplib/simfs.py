@@ -0,0 +1,96 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import errno
+import os
+import stat
+import time
+import readdir
+"""
+This module is a made-up filesystem for simulating tree walks (see
+tests/simpcp.py). Nothing is stored; the tree is worked out from its shape,
+and each operation sleeps for a set time to stand in for the filesystem.
+
+Every directory above depth holds fanout subdirectories (d0, d1, ...) and
+files files (f0, f1, ...), so the tree is regular and its size is known in
+advance:
+
+    fs = simfs.SimFS(fanout=10, depth=3, files=100, stat=0.0005)
+    fs.scandir("/sim/d1/d2")     # like readdir.scandir
+    fs.lstat("/sim/d1/d2/f7")    # like safestat.safestat
+"""
+
+
+class SimFS:
+    """A regular tree under root. The latencies are in seconds: stat for
+    each lstat, readdir for each directory read plus entry for each entry
+    in it. With dtype False, scandir does not give the type of entries, so
+    the walker has to stat them."""
+    def __init__(self, fanout, depth, files, root="/sim", stat=0.0,
+                 readdir=0.0, entry=0.0, dtype=True):
+        self.fanout = fanout
+        self.depth = depth
+        self.files = files
+        self.root = root.rstrip("/")
+        self.statlatency = stat
+        self.readdirlatency = readdir
+        self.entrylatency = entry
+        self.dtype = dtype
+
+    def totals(self):
+        """The number of (directories, files) in the tree, including the
+        root."""
+        dirs = sum(self.fanout ** level for level in range(self.depth + 1))
+        return((dirs, dirs * self.files))
+
+    def _level(self, path):
+        """The depth of path below the root, and whether it is a
+        directory. Raises OSError if there is no such path."""
+        if path == self.root:
+            return((0, True))
+        if not path.startswith(self.root + "/"):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        names = path[len(self.root) + 1:].split("/")
+        for i, name in enumerate(names):
+            isdir = name.startswith("d")
+            try:
+                n = int(name[1:])
+            except ValueError:
+                n = -1
+            last = i == len(names) - 1
+            if (name[:1] not in ("d", "f") or n < 0 or
+                n >= (self.fanout if isdir else self.files) or
+                (isdir and i >= self.depth) or
+                (not isdir and (not last or i > self.depth))):
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return((len(names), isdir))
+
+    def scandir(self, path):
+        """Yields (name, d_type, inode) for each entry of directory path."""
+        level, isdir = self._level(path)
+        if not isdir:
+            raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        if level < self.depth:
+            dirs, files = self.fanout, self.files
+        else:
+            dirs, files = 0, self.files
+        time.sleep(self.readdirlatency + self.entrylatency * (dirs + files))
+        if self.dtype:
+            dirtype, filetype = readdir.dirent.DT_DIR, readdir.dirent.DT_REG
+        else:
+            dirtype = filetype = readdir.dirent.DT_UNKNOWN
+        for i in xrange(dirs):
+            yield(("d%i" % i, dirtype, 0))
+        for i in xrange(files):
+            yield(("f%i" % i, filetype, 0))
+
+    def lstat(self, path):
+        """An os.stat_result for path."""
+        level, isdir = self._level(path)
+        time.sleep(self.statlatency)
+        if isdir:
+            mode = stat.S_IFDIR | 0755
+        else:
+            mode = stat.S_IFREG | 0644
+        return(os.stat_result((mode, 0, 0, 1, 0, 0, 0, 0, 0, 0)))
@@ -0,0 +1,61 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import errno
+import os
+"""
+This module finds the data in sparse files, so that copies can skip the holes
+rather than reading them as zeros and writing them out again in full.
+
+extents() uses lseek with SEEK_DATA and SEEK_HOLE. On kernels or filesystems
+which do not support them, the whole file is treated as data, which is what
+they do themselves for filesystems which do not track holes.
+"""
+
+# Not in the os module in python 2; these are the Linux values.
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
+
+# errnos which mean SEEK_DATA / SEEK_HOLE are not supported.
+_UNSUPPORTED = (errno.EINVAL, errno.EOPNOTSUPP)
+
+
+def extents(fd, offset, end, align=1):
+    """Yields a (start, stop) tuple for each range of data in file descriptor
+    fd between offset and end. The gaps between them are holes.
+
+    Ranges are widened to multiples of align (clamped to offset and end),
+    so that they can be read with O_DIRECT; offset should be a multiple of
+    align. The file position of fd is changed."""
+    pos = offset
+    while pos < end:
+        try:
+            start = os.lseek(fd, pos, SEEK_DATA)
+            stop = os.lseek(fd, start, SEEK_HOLE)
+        except OSError, error:
+            if error.errno == errno.ENXIO:
+                # Nothing but holes from pos to the end of the file.
+                return
+            if error.errno in _UNSUPPORTED:
+                yield((pos, end))
+                return
+            raise
+        if start >= end:
+            return
+        start = max(pos, start - start % align)
+        stop = min(end, ((stop + align - 1) // align) * align)
+        yield((start, stop))
+        pos = stop
+
+
+_zeros = ""
+
+
+def zeros(length):
+    """Returns a read-only buffer of length zero bytes, for checksumming
+    holes."""
+    global _zeros
+    if len(_zeros) < length:
+        _zeros = "\0" * length
+    return(buffer(_zeros, 0, length))
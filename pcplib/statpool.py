@@ -0,0 +1,105 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import Queue
+import threading
+import latency
+import safestat
+"""
+This module stats files on a pool of threads, so that a rank can have many
+stats outstanding at once. On lustre every stat is a round trip to the MDS;
+doing them one at a time leaves the walker waiting on the network.
+
+The stats for one file are submitted together, and handed back together once
+they have all finished:
+
+    pool = statpool.StatPool(8)
+    pool.submit(key, [destination, source])
+    ...
+    for key, stats in pool.ready():
+        ...
+"""
+
+
+def statall(paths, profiler=None):
+    """lstat each of paths in turn. Returns a list of the results, which are
+    os.stat_results or, where the stat failed, the OSError it raised."""
+    results = []
+    for path in paths:
+        if profiler:
+            start = latency.clock()
+        try:
+            results.append(safestat.safestat(path))
+        except OSError, error:
+            results.append(error)
+        if profiler:
+            profiler.record("stat", start)
+    return(results)
+
+
+class StatPool:
+    """Run lstats on threads threads. Each result is an os.stat_result or,
+    if the stat failed, the OSError it raised. If profiler (a
+    latency.Profiler) is given, the stats are timed in it."""
+    def __init__(self, threads, profiler=None):
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        # Groups of stats which have not all finished, by group number:
+        # [key, results, number still running].
+        self.pending = {}
+        self.nextgroup = 0
+        self.profiler = profiler
+        self.threads = [threading.Thread(target=self._worker)
+                        for i in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def __len__(self):
+        """The number of groups which have not been handed back yet."""
+        return(len(self.pending))
+
+    def _worker(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            group, i, path = request
+            self.results.put((group, i, statall([path], self.profiler)[0]))
+
+    def submit(self, key, paths):
+        """Stat each of paths. key comes back with the results."""
+        group = self.nextgroup
+        self.nextgroup += 1
+        self.pending[group] = [key, [None] * len(paths), len(paths)]
+        for i, path in enumerate(paths):
+            self.requests.put((group, i, path))
+
+    def ready(self, wait=False):
+        """Returns a list of (key, results) for the groups which have
+        finished since the last call, with the results in the same order as
+        the paths. With wait, blocks until at least one group has finished,
+        unless there are none outstanding."""
+        done = []
+        block = wait and len(self.pending) > 0
+        while True:
+            try:
+                group, i, result = self.results.get(block)
+            except Queue.Empty:
+                break
+            entry = self.pending[group]
+            entry[1][i] = result
+            entry[2] -= 1
+            if entry[2] == 0:
+                del self.pending[group]
+                done.append((entry[0], entry[1]))
+                block = False
+        return(done)
+
+    def close(self):
+        """Stop the threads. Outstanding stats are abandoned."""
+        for t in self.threads:
+            self.requests.put(None)
+        for t in self.threads:
+            t.join()
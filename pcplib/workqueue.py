@@ -0,0 +1,211 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import heapq
+from collections import deque
+"""
+This module provides the in-memory queues the pcp dispatcher takes work from.
+"""
+
+
+class Task(object):
+    """A file (or chunk of a file) which is being worked on.
+
+    Attributes:
+      idx: row ID in the state database.
+      filename: source file name.
+      chunk: chunk number, or -1 for the whole file.
+      priority: position in the dispatch order (lower goes first).
+      attempts: number of failed attempts so far.
+      lastrank: rank which last worked on the task, 0 if none.
+      srcmd5: checksum of the source.
+      size: size of the file or chunk (from the walk), replaced by the number
+        of bytes copied once it has been copied. None if not known.
+      state: state of the task, as stored in the database.
+      osts: OSTs the task reads from and writes to (see OSTLoad), or None.
+    """
+    __slots__ = ("idx", "filename", "chunk", "priority", "attempts",
+                 "lastrank", "srcmd5", "size", "state", "osts")
+
+    def __init__(self, idx, filename, chunk, priority=0, attempts=0,
+                 lastrank=0, srcmd5=None, size=None, state=0, osts=None):
+        self.idx = idx
+        self.filename = filename
+        self.chunk = chunk
+        self.priority = priority
+        self.attempts = attempts
+        self.lastrank = lastrank
+        self.srcmd5 = srcmd5
+        self.size = size
+        self.state = state
+        self.osts = osts
+
+
+class ReadyQueue:
+    """Tasks which are ready to be dispatched.
+
+    Tasks which have not been tried before are held in a heap ordered by
+    priority. Tasks which have already been worked on (retries, or copies
+    waiting to be checksummed) must not go back to the same rank, so they are
+    held in a FIFO for each lastrank. The FIFOs are served before the heap.
+
+    To keep memory down, untried tasks are held as (priority, idx, filename,
+    chunk, size, osts) tuples and only turned into Task objects when they are
+    popped.
+    """
+    # Number of untried tasks pop() looks at when balancing OST load.
+    LOOKAHEAD = 64
+
+    def __init__(self):
+        self.fresh = []
+        self.byrank = {}
+        # ranks with tasks waiting in self.byrank.
+        self.ranks = deque()
+        self.count = 0
+
+    def __len__(self):
+        return(self.count)
+
+    def push(self, task):
+        """Queue a task which has already been worked on, behind the other
+        tasks from the same rank."""
+        if task.lastrank not in self.byrank:
+            self.byrank[task.lastrank] = deque()
+            self.ranks.append(task.lastrank)
+        self.byrank[task.lastrank].append(task)
+        self.count += 1
+
+    def pushfresh(self, priority, idx, filename, chunk, size=None, osts=None):
+        """Queue an untried task without creating a Task object."""
+        heapq.heappush(self.fresh, (priority, idx, filename, chunk, size,
+                                    osts))
+        self.count += 1
+
+    def extendfresh(self, entries):
+        """Bulk load a list of (priority, idx, filename, chunk, size, osts)
+        tuples of untried tasks. The list is taken over by the queue."""
+        if self.fresh:
+            self.fresh.extend(entries)
+        else:
+            self.fresh = entries
+        heapq.heapify(self.fresh)
+        self.count += len(entries)
+
+    def pop(self, exclude=None, load=None):
+        """Return the next task whose lastrank is not exclude, or None if
+        there is no such task. exclude is a rank, or a frozenset of ranks.
+        If load (an OSTLoad) is given, untried tasks are picked to keep the
+        load on the OSTs balanced, and None is returned if all the
+        candidates are on OSTs which are at their limit."""
+        if not isinstance(exclude, frozenset):
+            exclude = frozenset((exclude,))
+        # We need to look at most one rank past the excluded ones.
+        for i in range(min(len(exclude) + 1, len(self.ranks))):
+            r = self.ranks[i]
+            if r in exclude:
+                continue
+            tasks = self.byrank[r]
+            task = tasks.popleft()
+            # round robin between ranks.
+            del self.ranks[i]
+            if tasks:
+                self.ranks.append(r)
+            else:
+                del self.byrank[r]
+            self.count -= 1
+            return(task)
+
+        if self.fresh:
+            if load is None:
+                entry = heapq.heappop(self.fresh)
+            else:
+                entry = self._popbalanced(load)
+                if entry is None:
+                    return(None)
+            priority, idx, filename, chunk, size, osts = entry
+            self.count -= 1
+            return(Task(idx, filename, chunk, priority, size=size, osts=osts))
+        return(None)
+
+    def _popbalanced(self, load):
+        """Pop the first of the next LOOKAHEAD untried tasks whose OSTs are
+        idle, or failing that the one whose busiest OST is least busy. The
+        other tasks go back in the heap."""
+        skipped = []
+        best = None
+        bestscore = None
+        try:
+            while self.fresh and len(skipped) < self.LOOKAHEAD:
+                entry = heapq.heappop(self.fresh)
+                score = load.score(entry[5])
+                if score == 0:
+                    if best is not None:
+                        skipped.append(best)
+                    best = entry
+                    break
+                if score is not None and (bestscore is None or
+                                          score < bestscore):
+                    if best is not None:
+                        skipped.append(best)
+                    best = entry
+                    bestscore = score
+                else:
+                    skipped.append(entry)
+        finally:
+            for entry in skipped:
+                heapq.heappush(self.fresh, entry)
+        return(best)
+
+
+class OSTLoad:
+    """Counts the tasks in flight on each OST, and the bytes moved to and
+    from each one.
+
+    OSTs are named by strings such as "s3" (OST 3 of the source filesystem)
+    or "d7" (OST 7 of the destination). A task's OSTs are held as a space
+    separated string of names.
+    """
+    def __init__(self, limit):
+        # Most tasks allowed in flight on one OST.
+        self.limit = limit
+        self.inflight = {}
+        self.peak = {}
+        self.bytes = {}
+
+    def score(self, osts):
+        """The number of tasks in flight on the busiest of osts, or None if
+        any of them is at the limit."""
+        busiest = 0
+        if osts:
+            for ost in osts.split():
+                n = self.inflight.get(ost, 0)
+                if n >= self.limit:
+                    return(None)
+                busiest = max(busiest, n)
+        return(busiest)
+
+    def started(self, osts):
+        """A task on osts has been dispatched."""
+        if osts:
+            for ost in osts.split():
+                n = self.inflight.get(ost, 0) + 1
+                self.inflight[ost] = n
+                if n > self.peak.get(ost, 0):
+                    self.peak[ost] = n
+
+    def finished(self, osts, size, moreosts=None):
+        """A task on osts has finished after moving size bytes. moreosts are
+        OSTs we only found out about when the task had finished (the
+        destination of a new file); they share the bytes but were not
+        counted as in flight."""
+        if osts:
+            for ost in osts.split():
+                self.inflight[ost] -= 1
+        for side in "sd":
+            names = [ost for ost in ((osts or "") + " " +
+                                     (moreosts or "")).split()
+                     if ost[0] == side]
+            for ost in names:
+                self.bytes[ost] = (self.bytes.get(ost, 0) +
+                                   (size or 0) / len(names))
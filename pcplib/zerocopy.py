@@ -0,0 +1,181 @@
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import ctypes
+import errno
+import fcntl
+import os
+"""
+This module provides a python interface to the in-kernel copy system calls
+copy_file_range, sendfile and splice. Data copied with these calls never
+passes through userspace.
+"""
+
+# Ctypes boilerplate
+_clib = ctypes.CDLL("libc.so.6", use_errno=True)
+_loff_p = ctypes.POINTER(ctypes.c_int64)
+
+# syscall numbers for copy_file_range; used if libc is too old to have a
+# wrapper.
+_SYS_copy_file_range = {"x86_64": 326, "aarch64": 285, "ppc64le": 379}
+_SYS_syscall = _clib.syscall
+_SYS_syscall.restype = ctypes.c_long
+
+SPLICE_F_MOVE = 1
+F_SETPIPE_SZ = 1031
+
+# Largest request we make of the kernel in one go.
+MAXREQUEST = 1 << 30
+
+# errnos which mean "this method does not work for these files"; we move on
+# to the next method rather than failing the copy.
+_UNSUPPORTED = (errno.ENOSYS, errno.EINVAL, errno.EXDEV, errno.EOPNOTSUPP,
+                errno.ENOTSUP)
+
+# Methods which returned ENOSYS are not tried again.
+_disabled = set()
+
+
+class Unsupported(Exception):
+    """None of the in-kernel methods could copy the data. copied holds the
+    number of bytes which were copied before we gave up."""
+    def __init__(self, copied):
+        Exception.__init__(self, "in-kernel copy not supported")
+        self.copied = copied
+
+
+def _copy_file_range_fn():
+    try:
+        fn = _clib.copy_file_range
+        fn.argtypes = [ctypes.c_int, _loff_p, ctypes.c_int, _loff_p,
+                       ctypes.c_size_t, ctypes.c_uint]
+        fn.restype = ctypes.c_ssize_t
+        return(fn)
+    except AttributeError:
+        nr = _SYS_copy_file_range.get(os.uname()[4])
+        if nr is None:
+            return(None)
+        return(lambda *args: _SYS_syscall(nr, *args))
+
+_copy_file_range = _copy_file_range_fn()
+
+_sendfile = _clib.sendfile64
+_sendfile.argtypes = [ctypes.c_int, ctypes.c_int, _loff_p, ctypes.c_size_t]
+_sendfile.restype = ctypes.c_ssize_t
+
+_splice = _clib.splice
+_splice.argtypes = [ctypes.c_int, _loff_p, ctypes.c_int, _loff_p,
+                    ctypes.c_size_t, ctypes.c_uint]
+_splice.restype = ctypes.c_ssize_t
+
+
+def _check(ret):
+    """Turn a -1 return into an OSError, retrying on EINTR/EAGAIN."""
+    if ret >= 0:
+        return(ret)
+    err = ctypes.get_errno()
+    if err in (errno.EINTR, errno.EAGAIN):
+        return(None)
+    raise OSError(err, os.strerror(err))
+
+
+def _request(done, length):
+    if length is None:
+        return(MAXREQUEST)
+    return(min(MAXREQUEST, length - done))
+
+# Each method copies from offset + progress[0] and keeps progress[0] up to
+# date, so that if it fails part way through the next method can carry on
+# from where it stopped.
+
+def _by_copy_file_range(infd, outfd, offset, length, progress):
+    inoff = ctypes.c_int64(offset + progress[0])
+    outoff = ctypes.c_int64(offset + progress[0])
+    while length is None or progress[0] < length:
+        n = _check(_copy_file_range(infd, ctypes.byref(inoff), outfd,
+                                    ctypes.byref(outoff),
+                                    _request(progress[0], length), 0))
+        if n is None:
+            continue
+        if n == 0:
+            break
+        progress[0] += n
+
+
+def _by_sendfile(infd, outfd, offset, length, progress):
+    # sendfile writes at the current position of outfd.
+    inoff = ctypes.c_int64(offset + progress[0])
+    os.lseek(outfd, offset + progress[0], os.SEEK_SET)
+    while length is None or progress[0] < length:
+        n = _check(_sendfile(outfd, infd, ctypes.byref(inoff),
+                             _request(progress[0], length)))
+        if n is None:
+            continue
+        if n == 0:
+            break
+        progress[0] += n
+
+
+def _by_splice(infd, outfd, offset, length, progress):
+    piper, pipew = os.pipe()
+    try:
+        try:
+            fcntl.fcntl(pipew, F_SETPIPE_SZ, 1 << 20)
+        except IOError:
+            pass
+        inoff = ctypes.c_int64(offset + progress[0])
+        outoff = ctypes.c_int64(offset + progress[0])
+        while length is None or progress[0] < length:
+            n = _check(_splice(infd, ctypes.byref(inoff), pipew, None,
+                               min(1 << 20, _request(progress[0], length)),
+                               SPLICE_F_MOVE))
+            if n is None:
+                continue
+            if n == 0:
+                break
+            while n > 0:
+                m = _check(_splice(piper, None, outfd, ctypes.byref(outoff),
+                                   n, SPLICE_F_MOVE))
+                if m is None:
+                    continue
+                n -= m
+                progress[0] += m
+    finally:
+        os.close(piper)
+        os.close(pipew)
+
+
+_METHODS = []
+if _copy_file_range is not None:
+    _METHODS.append(("copy_file_range", _by_copy_file_range))
+_METHODS.append(("sendfile", _by_sendfile))
+_METHODS.append(("splice", _by_splice))
+
+
+def copyrange(infd, outfd, offset=0, length=None):
+    """Copy length bytes starting at offset in file descriptor infd to the
+    same offset in outfd, without the data passing through userspace. If
+    length is None, copy until the end of infd.
+
+    Returns the number of bytes copied, which is only less than length if the
+    end of the source file was reached.
+
+    copy_file_range is tried first, followed by sendfile and splice. Raises
+    Unsupported if none of them can copy between these descriptors; the
+    exception records how much data was copied before the methods ran out, so
+    the caller can finish the copy by other means.
+    """
+    progress = [0]
+    for name, method in _METHODS:
+        if name in _disabled:
+            continue
+        try:
+            method(infd, outfd, offset, length, progress)
+            return(progress[0])
+        except OSError, error:
+            if error.errno not in _UNSUPPORTED:
+                raise
+            if error.errno == errno.ENOSYS:
+                _disabled.add(name)
+    raise Unsupported(progress[0])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import maketree
+"""
+End to end benchmark of pcp: copy a tree under a local mpirun at several rank
+counts and with several sets of pcp options, and record how fast each phase
+went.
+
+usage: benchpcp.py [-n RANKS] [-o=OPTIONS ...] [-r REPEATS] [-j JSONFILE]
+                   [-s SOURCE | tree shape options] [-d SCRATCH]
+
+If -s is not given, a tree is generated with maketree.py (the tree shape
+options are the same as maketree.py's) in SCRATCH and removed afterwards.
+Give pcp options as -o="-b 64", so that they are not taken as options to
+benchpcp.py itself; -o= runs pcp with no options.
+
+Each copy goes to a fresh directory in SCRATCH; put SCRATCH on tmpfs
+(e.g. /dev/shm) to benchmark pcp rather than the disk.
+
+For every run the JSON output has:
+
+  phase1_items_per_sec  files and dirs scanned per second (pcp's own figure)
+  phase2_mb_per_sec     MB copied per second in phase II
+  phase2_files_per_sec  files copied per second in phase II
+  phase3_secs           time spent setting directory timestamps (with -p)
+
+phase II figures come from pcp's metrics file (-M). The phase times are
+measured from when pcp prints the start and end of each phase. Runs are keyed
+by ranks and options, so the JSON from two versions of pcp can be compared
+with --compare.
+"""
+
+PCP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "pcp")
+
+DEFAULTOPTIONS = ["", "-b 64", "-c", "-p"]
+
+PHASES = [("phase1", re.compile(r"Starting phase I:"),
+           re.compile(r"Phase I done")),
+          ("phase2", re.compile(r"(Starting|Resuming) phase II:"),
+           re.compile(r"Phase II done")),
+          ("phase3", re.compile(r"Starting phase III:"),
+           re.compile(r"Phase III Done"))]
+
+ITEMSPERSEC = re.compile(r"Phase I done: .*\((\d+) items/sec\)")
+
+
+def runpcp(mpirun, ranks, options, source, dest, metricsfile):
+    """Copy source to dest with pcp, timestamping its output. Returns the
+    result dict for the run."""
+    cmd = (shlex.split(mpirun) + ["-n", str(ranks), sys.executable, "-u", PCP]
+           + shlex.split(options) + ["-M", metricsfile, source, dest])
+    phases = {}
+    itemspersec = None
+    output = []
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    for line in iter(proc.stdout.readline, ""):
+        now = time.time()
+        output.append(line)
+        for name, begin, end in PHASES:
+            if begin.search(line):
+                phases[name] = [now, None]
+            elif end.search(line) and name in phases:
+                phases[name][1] = now
+        match = ITEMSPERSEC.search(line)
+        if match:
+            itemspersec = int(match.group(1))
+    returncode = proc.wait()
+    walltime = time.time() - start
+
+    result = {"ranks": ranks,
+              "options": options,
+              "returncode": returncode,
+              "walltime": walltime,
+              "phase1_items_per_sec": itemspersec}
+    for name, _, _ in PHASES:
+        begin, end = phases.get(name, (None, None))
+        result[name + "_secs"] = None if end is None else end - begin
+
+    result["phase2_mb_per_sec"] = result["phase2_files_per_sec"] = None
+    try:
+        with open(metricsfile) as f:
+            metrics = json.load(f)
+    except (IOError, ValueError):
+        metrics = None
+    if metrics:
+        elapsed = max(metrics["elapsed"], 1e-6)
+        result["phase2_mb_per_sec"] = (metrics["bytes"]["copied"] /
+                                       elapsed / (1024 * 1024))
+        result["phase2_files_per_sec"] = metrics["items"]["copied"] / elapsed
+        result["bytes_copied"] = metrics["bytes"]["copied"]
+        result["files_copied"] = metrics["items"]["copied"]
+        result["warnings"] = metrics["warnings"]
+    if returncode != 0:
+        result["output"] = "".join(output[-20:])
+    return(result)
+
+
+def fmt(value, format):
+    if value is None:
+        return("-")
+    return(format % value)
+
+
+def report(results, compare):
+    """Print a table of the results, with the change from the results in
+    compare (a list of runs from an earlier benchmark) if given."""
+    old = {}
+    for run in compare or []:
+        old.setdefault((run["ranks"], run["options"]), []).append(run)
+    columns = [("phase1_items_per_sec", "items/s", "%.0f"),
+               ("phase2_mb_per_sec", "MB/s", "%.1f"),
+               ("phase2_files_per_sec", "files/s", "%.0f"),
+               ("phase3_secs", "III secs", "%.2f"),
+               ("walltime", "wall secs", "%.2f")]
+    print "%5s %-16s" % ("ranks", "options") + "".join(
+        " %12s" % title for _, title, _ in columns)
+    for run in results:
+        line = "%5i %-16s" % (run["ranks"], run["options"] or "(none)")
+        before = old.get((run["ranks"], run["options"]))
+        for key, _, format in columns:
+            cell = fmt(run[key], format)
+            values = [r[key] for r in before or [] if r.get(key)]
+            if values and run[key] is not None:
+                baseline = sum(values) / len(values)
+                cell += " %+.0f%%" % ((run[key] - baseline) * 100 / baseline)
+            line += " %12s" % cell
+        if run["returncode"] != 0:
+            line += "  FAILED (%i)" % run["returncode"]
+        print line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pcp end to end")
+    parser.add_argument("-n", help="comma separated list of rank counts",
+                        default="2,4")
+    parser.add_argument("-o", help="pcp options for a run, e.g. -o=\"-b 64\";"
+                        " may be given several times (default: %s)"
+                        % ", ".join(repr(o) for o in DEFAULTOPTIONS),
+                        action="append", dest="options")
+    parser.add_argument("-r", help="number of repeats", type=int, default=1)
+    parser.add_argument("-s", help="source tree (default: generate one)",
+                        dest="source")
+    parser.add_argument("-d", help="scratch directory (default: $TMPDIR)",
+                        dest="scratch", default=None)
+    parser.add_argument("-j", help="write the results to this JSON file",
+                        dest="jsonfile")
+    parser.add_argument("--compare", help="JSON file from an earlier run to"
+                        " compare against")
+    parser.add_argument("--mpirun", help="mpirun command (default: %(default)s)",
+                        default="mpirun")
+    maketree.addarguments(parser)
+    args = parser.parse_args()
+    ranklist = [int(r) for r in args.n.split(",")]
+    options = args.options or DEFAULTOPTIONS
+
+    scratch = tempfile.mkdtemp(prefix="benchpcp", dir=args.scratch)
+    try:
+        if args.source:
+            source = os.path.abspath(args.source)
+            tree = {"directory": source}
+        else:
+            shape = maketree.shape(args)
+            if not any(shape[k] for k in ("tiny", "deep", "wide", "huge",
+                                          "sparse")):
+                shape.update(tiny=10000, deep=50, wide=5000, huge=2,
+                             hugesize=256 * 1024 * 1024, sparse=2,
+                             sparsesize=256 * 1024 * 1024)
+            source = os.path.join(scratch, "source")
+            print "Generating tree in %s..." % source
+            start = time.time()
+            tree = maketree.maketree(source, **shape)
+            print ("Generated %i files, %i dirs, %i bytes in %.1f secs"
+                   % (tree["files"], tree["dirs"], tree["bytes"],
+                      time.time() - start))
+
+        results = []
+        for repeat, ranks, opts in itertools.product(range(args.r), ranklist,
+                                                     options):
+            dest = os.path.join(scratch, "dest")
+            metricsfile = os.path.join(scratch, "metrics.json")
+            print "Run %i: %i ranks, pcp %s" % (repeat, ranks, opts)
+            result = runpcp(args.mpirun, ranks, opts, source, dest,
+                            metricsfile)
+            result["repeat"] = repeat
+            results.append(result)
+            shutil.rmtree(dest, ignore_errors=True)
+            if os.path.exists(metricsfile):
+                os.unlink(metricsfile)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    compare = None
+    if args.compare:
+        with open(args.compare) as f:
+            compare = json.load(f)["runs"]
+    print
+    report(results, compare)
+
+    if args.jsonfile:
+        with open(args.jsonfile, "w") as f:
+            json.dump({"host": socket.gethostname(),
+                       "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "tree": tree,
+                       "runs": results}, f, indent=1, sort_keys=True)
+        print "Results written to %s" % args.jsonfile
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from pcplib import readdir
+"""
+Benchmark the directory enumerators in pcplib.readdir against each other and
+against os.listdir.
+
+usage: benchreaddir.py [-n FILES] [-r REPEATS] [DIRECTORY]
+
+If DIRECTORY is not given, a temporary directory containing FILES empty files
+is created (and removed afterwards).
+"""
+
+
+def old_readdir(directory):
+    return([d.d_name for d in readdir.readdir(directory)
+            if d.d_name not in (".", "..")])
+
+
+def new_scandir(directory):
+    return([e[0] for e in readdir.scandir(directory)])
+
+
+def listdir(directory):
+    return(os.listdir(directory))
+
+
+METHODS = [("readdir.readdir", old_readdir),
+           ("readdir.scandir", new_scandir),
+           ("os.listdir", listdir)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pcplib.readdir")
+    parser.add_argument("DIRECTORY", nargs="?", default=None)
+    parser.add_argument("-n", help="number of files to create", type=int,
+                        default=200000)
+    parser.add_argument("-r", help="number of repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = None
+    directory = args.DIRECTORY
+    if directory is None:
+        tmpdir = tempfile.mkdtemp(prefix="benchreaddir")
+        directory = tmpdir
+        print "Creating %i files in %s..." % (args.n, directory)
+        for i in xrange(args.n):
+            open(os.path.join(directory, "file%08i" % i), "w").close()
+
+    try:
+        expected = sorted(listdir(directory))
+        for name, method in METHODS:
+            if sorted(method(directory)) != expected:
+                print "ERROR: %s returned the wrong entries" % name
+                sys.exit(1)
+
+        print "%i entries, best of %i runs" % (len(expected), args.r)
+        for name, method in METHODS:
+            best = None
+            for i in range(args.r):
+                start = time.time()
+                method(directory)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+            print "%-16s %8.3f secs %10.0f entries/sec" \
+                % (name, best, len(expected) / best)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import argparse
+import json
+import os
+import random
+import sys
+"""
+Generate a synthetic directory tree for benchmarking pcp (see benchpcp.py).
+
+usage: maketree.py [options] DIRECTORY
+
+The tree is built from any mix of:
+
+  --tiny N       N tiny files (up to --tinysize bytes), --fanout to a directory
+  --deep N       a chain of N nested directories, with a small file in each
+  --wide N       N empty files in a single directory
+  --huge N       N files of --hugesize bytes
+  --sparse N     N sparse files of --sparsesize bytes, of which one block in
+                 every --sparsegap holds data
+
+Each part goes in its own subdirectory of DIRECTORY. Sizes may be suffixed
+with k, M, G or T. File contents are random, but the same for the same
+--seed, so trees made on different machines are the same.
+"""
+
+BLOCK = 1024 * 1024
+SUFFIXES = {"k": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def size(text):
+    """Parse a size such as 4k or 10G."""
+    if text and text[-1] in SUFFIXES:
+        return(int(float(text[:-1]) * SUFFIXES[text[-1]]))
+    return(int(text))
+
+
+class Generator:
+    """Makes the files of a tree. The data written comes from a block of
+    random bytes, read at random offsets, which is much quicker than making
+    new random data for every file."""
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.data = "".join(chr(self.random.getrandbits(8))
+                            for i in xrange(BLOCK))
+        self.files = 0
+        self.dirs = 0
+        self.bytes = 0
+
+    def mkdir(self, path):
+        os.makedirs(path)
+        self.dirs += 1
+
+    def write(self, f, length):
+        while length > 0:
+            n = min(length, BLOCK)
+            start = self.random.randrange(0, BLOCK - n + 1)
+            f.write(self.data[start:start + n])
+            length -= n
+
+    def makefile(self, path, length):
+        with open(path, "wb") as f:
+            self.write(f, length)
+        self.files += 1
+        self.bytes += length
+
+    def tiny(self, top, count, maxsize, fanout):
+        for i in xrange(count):
+            if i % fanout == 0:
+                directory = os.path.join(top, "d%06i" % (i // fanout))
+                self.mkdir(directory)
+            self.makefile(os.path.join(directory, "f%08i" % i),
+                          self.random.randint(0, maxsize))
+
+    def deep(self, top, depth):
+        directory = top
+        for i in xrange(depth):
+            directory = os.path.join(directory, "d%i" % i)
+            self.mkdir(directory)
+            self.makefile(os.path.join(directory, "f"), 1024)
+
+    def wide(self, top, count):
+        self.mkdir(top)
+        for i in xrange(count):
+            self.makefile(os.path.join(top, "f%08i" % i), 0)
+
+    def huge(self, top, count, length):
+        self.mkdir(top)
+        for i in xrange(count):
+            self.makefile(os.path.join(top, "huge%i" % i), length)
+
+    def sparse(self, top, count, length, gap):
+        self.mkdir(top)
+        for i in xrange(count):
+            path = os.path.join(top, "sparse%i" % i)
+            with open(path, "wb") as f:
+                for offset in xrange(0, length, BLOCK * gap):
+                    f.seek(offset)
+                    self.write(f, min(BLOCK, length - offset))
+                f.truncate(length)
+            self.files += 1
+            self.bytes += length
+
+
+def maketree(directory, tiny=0, tinysize=4096, fanout=1000, deep=0, wide=0,
+             huge=0, hugesize=BLOCK * 1024, sparse=0, sparsesize=BLOCK * 1024,
+             sparsegap=16, seed=0):
+    """Make a tree in directory, which must not exist yet. Returns a dict
+    describing it."""
+    generator = Generator(seed)
+    generator.mkdir(directory)
+    if tiny:
+        generator.tiny(os.path.join(directory, "tiny"), tiny, tinysize,
+                       fanout)
+    if deep:
+        generator.deep(os.path.join(directory, "deep"), deep)
+    if wide:
+        generator.wide(os.path.join(directory, "wide"), wide)
+    if huge:
+        generator.huge(os.path.join(directory, "huge"), huge, hugesize)
+    if sparse:
+        generator.sparse(os.path.join(directory, "sparse"), sparse,
+                         sparsesize, sparsegap)
+    return({"directory": os.path.abspath(directory),
+            "files": generator.files,
+            "dirs": generator.dirs,
+            "bytes": generator.bytes,
+            "shape": {"tiny": tiny, "tinysize": tinysize, "fanout": fanout,
+                      "deep": deep, "wide": wide, "huge": huge,
+                      "hugesize": hugesize, "sparse": sparse,
+                      "sparsesize": sparsesize, "sparsegap": sparsegap,
+                      "seed": seed}})
+
+
+def addarguments(parser):
+    """Add the tree shape options to an argparse parser."""
+    parser.add_argument("--tiny", help="number of tiny files", type=int,
+                        default=0)
+    parser.add_argument("--tinysize", help="largest tiny file", type=size,
+                        default=4096)
+    parser.add_argument("--fanout", help="tiny files per directory",
+                        type=int, default=1000)
+    parser.add_argument("--deep", help="depth of the deep directory chain",
+                        type=int, default=0)
+    parser.add_argument("--wide", help="files in the wide directory",
+                        type=int, default=0)
+    parser.add_argument("--huge", help="number of huge files", type=int,
+                        default=0)
+    parser.add_argument("--hugesize", help="size of the huge files",
+                        type=size, default=BLOCK * 1024)
+    parser.add_argument("--sparse", help="number of sparse files", type=int,
+                        default=0)
+    parser.add_argument("--sparsesize", help="size of the sparse files",
+                        type=size, default=BLOCK * 1024)
+    parser.add_argument("--sparsegap",
+                        help="one MB in every SPARSEGAP holds data",
+                        type=int, default=16)
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+
+
+def shape(args):
+    """The tree shape options from parsed arguments, as keyword arguments
+    for maketree."""
+    return(dict((k, getattr(args, k))
+                for k in ("tiny", "tinysize", "fanout", "deep", "wide",
+                          "huge", "hugesize", "sparse", "sparsesize",
+                          "sparsegap", "seed")))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a directory tree for benchmarking pcp")
+    parser.add_argument("DIRECTORY")
+    addarguments(parser)
+    args = parser.parse_args()
+    if os.path.exists(args.DIRECTORY):
+        print "ERROR: %s already exists" % args.DIRECTORY
+        sys.exit(1)
+    summary = maketree(args.DIRECTORY, **shape(args))
+    json.dump(summary, sys.stdout, indent=1, sort_keys=True)
+    print
+
+if __name__ == "__main__":
+    main()
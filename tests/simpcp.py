@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright Genome Research Ltd 2014
+# Author gmpc@sanger.ac.uk
+# This program is released under the GNU Public License V2 or later (GPLV2+)
+
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from pcplib import fakempi
+# Everything which imports mpi4py has to come after this.
+fakempi.install()
+from pcplib import parallelwalk
+from pcplib import simfs
+"""
+Simulate pcp at scale in a single process, using pcplib.fakempi in place of
+MPI. There are two simulations:
+
+usage: simpcp.py walk [-n RANKS] [-N PERNODE] [--steal POLICY]
+                      [tree shape and latency options]
+       simpcp.py pcp [-n RANKS] [-N PERNODE] [--] [pcp options] SOURCE DEST
+
+walk runs the parallel tree walker (pcplib.parallelwalk) over a made-up tree
+(pcplib.simfs), in which stat and readdir take as long as you ask them to.
+It checks that every file was found exactly once, and prints JSON with the
+walk rate, the work stealing efficiency (the fraction of requests for work
+which got some), and the cost of termination detection: the number of times
+the token went round and the time from the last item being processed to the
+walk finishing.
+
+pcp runs the whole of pcp, with each rank in a thread, as though it had been
+started with mpirun -n RANKS. The copy is real, so use --dry-run to exercise
+the dispatcher without copying anything; pcp's own statistics (and -M
+metrics) then show how fast the dispatcher can hand out work.
+
+With -N, ranks are spread over pretend nodes of PERNODE ranks, for -Wl and
+-H.
+
+All of the ranks share one process, and so one CPU. Message and steal counts
+are what a real run would see, but times are only good for comparing one
+simulation with another.
+"""
+
+PCP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "pcp")
+
+
+class simwalk(parallelwalk.ParallelWalk):
+    """Counts what it finds, and when it last found something."""
+    def __init__(self, comm, fs, steal):
+        parallelwalk.ParallelWalk.__init__(self, comm, results=[0, 0],
+                                           steal=steal)
+        self.scandir = fs.scandir
+        self.lstat = fs.lstat
+        self.lastitem = None
+
+    def ProcessDir(self, directoryname):
+        self.results[0] += 1
+        self.lastitem = time.time()
+
+    def ProcessFile(self, filename):
+        self.results[1] += 1
+        self.lastitem = time.time()
+
+
+def walk(args):
+    fs = simfs.SimFS(args.fanout, args.depth, args.files, stat=args.stat,
+                     readdir=args.readdir, entry=args.entry,
+                     dtype=not args.nodtype)
+    dirs, files = fs.totals()
+    walkers = [None] * args.n
+    finished = [None] * args.n
+
+    def rank():
+        comm = fakempi.COMM_WORLD
+        walker = simwalk(comm, fs, args.steal)
+        walkers[comm.rank] = walker
+        walker.Execute(fs.root)
+        finished[comm.rank] = time.time()
+
+    print >> sys.stderr, ("Walking %i dirs and %i files with %i ranks..."
+                          % (dirs, files, args.n))
+    world = fakempi.World(args.n, args.N)
+    start = time.time()
+    codes = world.run(rank)
+    elapsed = time.time() - start
+    if any(codes):
+        print >> sys.stderr, "ERROR: the walk failed."
+        sys.exit(1)
+
+    founddirs = sum(w.results[0] for w in walkers)
+    foundfiles = sum(w.results[1] for w in walkers)
+    stats = {}
+    for w in walkers:
+        for k, v in w.stats.iteritems():
+            stats[k] = stats.get(k, 0) + v
+    sent = walkers[0].comm.sent
+    lastitem = max(w.lastitem for w in walkers if w.lastitem)
+    result = {"ranks": args.n,
+              "pernode": args.N or args.n,
+              "steal": args.steal,
+              "dirs": founddirs,
+              "files": foundfiles,
+              "elapsed": elapsed,
+              "items_per_sec": (founddirs + foundfiles) / elapsed,
+              "steals": stats,
+              "steal_efficiency": (float(stats["steals"]) /
+                                   max(stats["requests"], 1)),
+              "token_passes": sent.get(2, [0])[0],
+              "termination_secs": max(finished) - lastitem,
+              "messages": sum(n for n, nbytes in sent.itervalues()),
+              "bytes": sum(nbytes for n, nbytes in sent.itervalues())}
+    json.dump(result, sys.stdout, indent=1, sort_keys=True)
+    print
+    if (founddirs, foundfiles) != (dirs, files):
+        print >> sys.stderr, ("ERROR: found %i dirs and %i files; expected"
+                              " %i and %i." % (founddirs, foundfiles, dirs,
+                                               files))
+        sys.exit(1)
+
+
+def runpcp(args):
+    # pcp catches SIGUSR1, which python only allows in the main thread.
+    setsignal = signal.signal
+
+    def mainonly(signum, handler):
+        if threading.current_thread().name == "MainThread":
+            return(setsignal(signum, handler))
+    signal.signal = mainonly
+
+    pcpargs = args.pcpargs
+    if pcpargs[:1] == ["--"]:
+        pcpargs = pcpargs[1:]
+    sys.argv = [PCP] + pcpargs
+    with open(PCP) as f:
+        code = compile(f.read(), PCP, "exec")
+
+    def rank():
+        # Each rank gets its own copy of pcp's globals.
+        namespace = {"__name__": "__main__", "__file__": PCP}
+        exec code in namespace
+
+    world = fakempi.World(args.n, args.N)
+    codes = world.run(rank)
+    sys.exit(max(codes) or 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate pcp in a single process")
+    subparsers = parser.add_subparsers()
+
+    walkparser = subparsers.add_parser("walk", help="simulate a tree walk")
+    walkparser.add_argument("-n", help="number of ranks", type=int,
+                            default=64)
+    walkparser.add_argument("-N", help="ranks per node", type=int,
+                            default=None)
+    walkparser.add_argument("--steal", help="work stealing policy",
+                            choices=("random", "local"), default="random")
+    walkparser.add_argument("--fanout", help="subdirectories per directory",
+                            type=int, default=10)
+    walkparser.add_argument("--depth", help="depth of the tree", type=int,
+                            default=3)
+    walkparser.add_argument("--files", help="files per directory", type=int,
+                            default=100)
+    walkparser.add_argument("--stat", help="seconds per stat", type=float,
+                            default=0.0)
+    walkparser.add_argument("--readdir", help="seconds per readdir",
+                            type=float, default=0.0)
+    walkparser.add_argument("--entry", help="seconds per directory entry",
+                            type=float, default=0.0)
+    walkparser.add_argument("--nodtype", help="readdir does not return file"
+                            " types, so every entry is stat'ed",
+                            action="store_true", default=False)
+    walkparser.set_defaults(func=walk)
+
+    pcpparser = subparsers.add_parser("pcp", help="simulate a pcp run")
+    pcpparser.add_argument("-n", help="number of ranks", type=int,
+                           default=16)
+    pcpparser.add_argument("-N", help="ranks per node", type=int,
+                           default=None)
+    pcpparser.add_argument("pcpargs", nargs=argparse.REMAINDER)
+    pcpparser.set_defaults(func=runpcp)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
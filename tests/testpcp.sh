@@ -52,6 +52,85 @@ testchunkcopy() {
     assertEquals "Chunk copy corrupted file" 0 $?
 }
 
+testupdatechunked() {
+    dd if=/dev/urandom bs=1M count=5 of=$SHUNIT_TMPDIR/a/testfile > /dev/null 2>&1
+    dd if=/dev/urandom bs=1k count=5 of=$SHUNIT_TMPDIR/a/smallfile > /dev/null 2>&1
+    mpirun -n 3 $PCP -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/testfile > /dev/null 2>&1
+    touch -d "+1 hour" $SHUNIT_TMPDIR/a/testfile
+    mpirun -n 3 $PCP -b 1 -u $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Update copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Chunked update copy failed" 0 $?
+}
+
+testincremental() {
+    for X in `seq 1 10`  ; do
+	dd if=/dev/urandom bs=1k count=16 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n 3 $PCP -p $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    dd if=/dev/urandom bs=1k count=8 of=$SHUNIT_TMPDIR/a/testfile1 > /dev/null 2>&1
+    for THREADS in 0 4 ; do
+	rm -rf $SHUNIT_TMPDIR/c
+	mpirun -n 3 $PCP -p -ut $THREADS -i $SHUNIT_TMPDIR/b $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+	assertEquals "Incremental copy failed" 0 $?
+	diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+	assertEquals "Incremental copy differs" 0 $?
+	assertEquals "Unchanged file not linked" 2 `stat -c%h $SHUNIT_TMPDIR/b/testfile2`
+	rm -rf $SHUNIT_TMPDIR/c
+    done
+}
+
+testbaseline() {
+    for X in `seq 1 10`  ; do
+	dd if=/dev/urandom bs=1k count=16 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    mpirun -n 3 $PCP -c -b 1 -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    # A plain -u would copy testfile2 again, as the destination is older; the
+    # baseline knows the source has not changed.
+    echo stale > $SHUNIT_TMPDIR/b/testfile2
+    touch -d "-1 hour" $SHUNIT_TMPDIR/b/testfile2
+    dd if=/dev/urandom bs=1k count=8 of=$SHUNIT_TMPDIR/a/testfile1 > /dev/null 2>&1
+    touch -d "+1 hour" $SHUNIT_TMPDIR/a/testfile1
+    mpirun -n 3 $PCP -c -b 1 -u -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b > $SHUNIT_TMPDIR/log
+    assertEquals "Update copy failed" 0 $?
+    grep -q "1 files (8.00 kbytes) will be copied" $SHUNIT_TMPDIR/log
+    assertEquals "Baseline not used" 0 $?
+    cmp $SHUNIT_TMPDIR/a/testfile1 $SHUNIT_TMPDIR/b/testfile1
+    assertEquals "Changed file not copied" 0 $?
+    assertEquals "Unchanged file copied" stale "`cat $SHUNIT_TMPDIR/b/testfile2`"
+    cp $SHUNIT_TMPDIR/a/testfile2 $SHUNIT_TMPDIR/b/testfile2
+    # A compare only checksums the destinations of the whole files; their
+    # source checksums are in the baseline. bigfile's 3 chunks take 2 each.
+    mpirun -n 3 $PCP -C -b 1 -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b > $SHUNIT_TMPDIR/log
+    assertEquals "Compare with baseline failed" 0 $?
+    grep -q "Dispatcher sent 16 tasks" $SHUNIT_TMPDIR/log
+    assertEquals "Recorded checksums not used" 0 $?
+    # The new baseline records the update, so -i can link everything.
+    mpirun -n 3 $PCP -c -b 1 -i $SHUNIT_TMPDIR/b -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c > $SHUNIT_TMPDIR/log
+    assertEquals "Incremental copy failed" 0 $?
+    grep -q "0 files (0.00 bytes) will be copied" $SHUNIT_TMPDIR/log
+    assertEquals "Baseline not used for -i" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+    assertEquals "Incremental copy differs" 0 $?
+    assertEquals "Unchanged file not linked" 2 `stat -c%h $SHUNIT_TMPDIR/b/bigfile`
+    rm -rf $SHUNIT_TMPDIR/c
+    # A change of mode leaves the mtime alone, but must not be linked.
+    mpirun -n 3 $PCP -p -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/c
+    assertEquals "Preserving copy failed" 0 $?
+    chmod 600 $SHUNIT_TMPDIR/a/testfile3
+    mpirun -n 3 $PCP -p -i $SHUNIT_TMPDIR/c -S $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/d
+    assertEquals "Incremental copy after chmod failed" 0 $?
+    assertEquals "Mode change not copied" 600 `stat -c%a $SHUNIT_TMPDIR/d/testfile3`
+    assertEquals "Changed file linked" 1 `stat -c%h $SHUNIT_TMPDIR/d/testfile3`
+    assertEquals "Unchanged file not linked" 2 `stat -c%h $SHUNIT_TMPDIR/d/testfile4`
+    rm -rf $SHUNIT_TMPDIR/c $SHUNIT_TMPDIR/d $SHUNIT_TMPDIR/baseline $SHUNIT_TMPDIR/log
+}
+
 testmulticopy() {
     FILES=5
     RANKS=3
@@ -67,6 +146,230 @@ testmulticopy() {
 }
 
 
+testunbatched() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=1 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -B 1 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b 
+    assertEquals "Copy failed" 0 $?
+    for X in `seq 1 $FILES` ; do
+	cmp $SHUNIT_TMPDIR/a/testfile$X $SHUNIT_TMPDIR/b/testfile$X
+	assertEquals "Unbatched copy failed" 0 $?
+    done
+}
+
+testglob() {
+    RANKS=3
+    for X in `seq 1 10`  ; do
+	echo $X > $SHUNIT_TMPDIR/a/keep$X.txt
+	echo $X > $SHUNIT_TMPDIR/a/skip$X.dat
+    done
+    mpirun -n $RANKS $PCP -g '*.txt' $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    assertEquals "Wrong number of files copied" 10 `ls $SHUNIT_TMPDIR/b | wc -l`
+    assertEquals "Non matching files copied" 0 `ls $SHUNIT_TMPDIR/b | grep -c skip`
+}
+
+testmanifest() {
+    RANKS=3
+    mkdir -p $SHUNIT_TMPDIR/a/sub1/deep $SHUNIT_TMPDIR/a/sub2
+    for X in `seq 1 5`  ; do
+	echo $X > $SHUNIT_TMPDIR/a/sub1/deep/file$X
+	echo $X > $SHUNIT_TMPDIR/a/sub2/file$X
+    done
+    echo sub1/deep/file1 > $SHUNIT_TMPDIR/manifest
+    echo sub1/deep/file2 >> $SHUNIT_TMPDIR/manifest
+    echo $SHUNIT_TMPDIR/a/sub2 >> $SHUNIT_TMPDIR/manifest
+    mpirun -n $RANKS $PCP -m $SHUNIT_TMPDIR/manifest $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    assertEquals "Wrong number of files copied" 7 `find $SHUNIT_TMPDIR/b -type f | wc -l`
+    cmp $SHUNIT_TMPDIR/a/sub1/deep/file2 $SHUNIT_TMPDIR/b/sub1/deep/file2
+    assertEquals "Manifest file not copied" 0 $?
+    diff -r $SHUNIT_TMPDIR/a/sub2 $SHUNIT_TMPDIR/b/sub2
+    assertEquals "Manifest directory not copied" 0 $?
+}
+
+testpipelined() {
+    FILES=20
+    RANKS=4
+    mkdir -p $SHUNIT_TMPDIR/a/sub1 $SHUNIT_TMPDIR/a/sub2
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1k count=16 of=$SHUNIT_TMPDIR/a/sub$((X % 2 + 1))/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -P 1 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Pipelined copy failed" 0 $?
+}
+
+testchecksumalgorithm() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=1 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -c -ca crc32 -K $SHUNIT_TMPDIR/dump.gz -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "crc32 checksummed copy failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/dump.gz
+    assertEquals "Verify from checkpoint failed" 0 $?
+}
+
+testwholefilechecksum() {
+    RANKS=3
+    dd if=/dev/urandom bs=1M count=5 of=$SHUNIT_TMPDIR/a/testfile > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -b 1 -cw -ca crc32 -K $SHUNIT_TMPDIR/dump.gz -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Chunked crc32 copy failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/dump.gz
+    assertEquals "Verify from checkpoint failed" 0 $?
+}
+
+testcompare() {
+    RANKS=4
+    for X in `seq 1 5`  ; do
+	dd if=/dev/urandom bs=1k count=16 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    dd if=/dev/urandom bs=1M count=3 of=$SHUNIT_TMPDIR/a/bigfile > /dev/null 2>&1
+    cp -a $SHUNIT_TMPDIR/a/. $SHUNIT_TMPDIR/b
+    mpirun -n $RANKS $PCP -C -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Compare of identical trees failed" 0 $?
+    rm $SHUNIT_TMPDIR/b/testfile1
+    printf 'X' | dd of=$SHUNIT_TMPDIR/b/bigfile bs=1 seek=1500000 conv=notrunc > /dev/null 2>&1
+    mpirun -n $RANKS $PCP -C -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b > $SHUNIT_TMPDIR/log
+    assertNotEquals "Compare of different trees passed" 0 $?
+    grep -q "^COPYFAIL:$SHUNIT_TMPDIR/b/testfile1$" $SHUNIT_TMPDIR/log
+    assertEquals "Missing file not reported" 0 $?
+    grep -q "^MD5FAIL,1:$SHUNIT_TMPDIR/b/bigfile$" $SHUNIT_TMPDIR/log
+    assertEquals "Changed chunk not reported" 0 $?
+    assertEquals "Unchanged files reported" 2 `grep -c FAIL $SHUNIT_TMPDIR/log`
+    rm -f $SHUNIT_TMPDIR/log
+}
+
+testdirectio() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=12345 count=$((X * 50)) of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -O -c -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "O_DIRECT copy failed" 0 $?
+}
+
+testthreads() {
+    FILES=50
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1k count=64 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -T 4 -c -b 0 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Threaded copy failed" 0 $?
+}
+
+testsparse() {
+    dd if=/dev/urandom bs=1k count=64 seek=2048 of=$SHUNIT_TMPDIR/a/sparsefile > /dev/null 2>&1
+    truncate -s 5M $SHUNIT_TMPDIR/a/sparsefile
+    mpirun -n 3 $PCP -c -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    cmp $SHUNIT_TMPDIR/a/sparsefile $SHUNIT_TMPDIR/b/sparsefile
+    assertEquals "Sparse copy failed" 0 $?
+    BLOCKS=`stat -c %b $SHUNIT_TMPDIR/b/sparsefile`
+    assertTrue "Holes were not preserved" "[ $BLOCKS -lt 1024 ]"
+}
+
+testostaware() {
+    FILES=10
+    RANKS=4
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=2 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    # With -T 2, up to 6 copies could run at once on the 4 pretend OSTs.
+    mpirun -n $RANKS $PCP -lo 1 -lofake 4 -T 2 -b 1 -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b > $SHUNIT_TMPDIR/log
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "OST aware copy failed" 0 $?
+    # Every byte is read from and written to an OST in the report, and no
+    # OST ever had more copies on it than -lo allows.
+    assertEquals "Wrong bytes read from OSTs" 20.00 \
+	`awk '/^Source OST/ && $5 == "Mbytes" {n += $4} END {printf "%.2f", n}' $SHUNIT_TMPDIR/log`
+    assertEquals "Wrong bytes written to OSTs" 20.00 \
+	`awk '/^Destination OST/ && $5 == "Mbytes" {n += $4} END {printf "%.2f", n}' $SHUNIT_TMPDIR/log`
+    assertEquals "OST limit exceeded" 1 \
+	`awk '/ OST [0-9]+:/ && $(NF-3) > n {n = $(NF-3)} END {print n}' $SHUNIT_TMPDIR/log`
+    rm -f $SHUNIT_TMPDIR/log
+}
+
+testhierarchical() {
+    FILES=20
+    RANKS=5
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1k count=256 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -H -c -b 1 -K $SHUNIT_TMPDIR/dump.gz -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Hierarchical copy failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/dump.gz
+    assertEquals "Hierarchical verify failed" 0 $?
+}
+
+testmetrics() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=1 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -c -s 1 -M $SHUNIT_TMPDIR/metrics.json $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    grep -q '"finished": true' $SHUNIT_TMPDIR/metrics.json
+    assertEquals "Metrics file not written" 0 $?
+}
+
+testprofile() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=1 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -pf -c $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b > $SHUNIT_TMPDIR/profile.txt
+    assertEquals "Copy failed" 0 $?
+    grep -q "^read " $SHUNIT_TMPDIR/profile.txt
+    assertEquals "No profile printed" 0 $?
+}
+
+testsimulate() {
+    ./simpcp.py walk -n 32 -N 8 --steal local --fanout 4 --depth 3 --files 10 > /dev/null
+    assertEquals "Simulated walk failed" 0 $?
+    FILES=20
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1k count=256 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    ./simpcp.py pcp -n 12 -N 4 -- -H -Hg 4 -c -b 1 $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Simulated copy failed" 0 $?
+    diff -r $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Simulated copy differs" 0 $?
+}
+
+testcheckpoint() {
+    FILES=5
+    RANKS=3
+    for X in `seq 1 $FILES`  ; do
+	dd if=/dev/urandom bs=1M count=1 of=$SHUNIT_TMPDIR/a/testfile$X > /dev/null 2>&1
+    done
+    mpirun -n $RANKS $PCP -c -K $SHUNIT_TMPDIR/dump.gz -Kx $SHUNIT_TMPDIR/a $SHUNIT_TMPDIR/b
+    assertEquals "Copy failed" 0 $?
+    mpirun -n $RANKS $PCP -Rv $SHUNIT_TMPDIR/dump.gz
+    assertEquals "Verify from checkpoint failed" 0 $?
+}
+
 testpreserve() {
     FILES=5
     RANKS=2